@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test initializing the nodes from a chain fixture (see test_framework/fixtures.py).
+
+The chained_mempool fixture is built by the first test that needs it and
+copied from the cache directory afterwards. Check that all nodes start with
+its chain and mempool, and that the data returned by the build matches them.
+"""
+
+import os
+
+from test_framework.fixtures import chained_mempool
+from test_framework.messages import COIN
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal
+
+NUM_TXS = 60
+CHAIN_LENGTH = 20
+
+
+class ChainFixtureTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 2
+        self.chain_fixture = chained_mempool(NUM_TXS, chain_length=CHAIN_LENGTH)
+
+    def run_test(self):
+        self.log.info("Check that the fixture is in the cache directory")
+        assert os.path.isdir(os.path.join(self.options.cachedir, self.chain_fixture.dirname()))
+
+        self.log.info("Check that all nodes start with the chain and the mempool of the fixture")
+        assert_equal(len({node.getbestblockhash() for node in self.nodes}), 1)
+        for node in self.nodes:
+            assert not node.getblockchaininfo()['initialblockdownload']
+            self.wait_until(lambda: node.getmempoolinfo()['loaded'])
+            assert_equal(node.getmempoolinfo()['size'], NUM_TXS)
+        assert_equal(set(self.nodes[0].getrawmempool()), set(self.nodes[1].getrawmempool()))
+
+        self.log.info("Check the data returned by the fixture build")
+        node = self.nodes[0]
+        utxos = self.fixture_data['utxos']
+        assert_equal(len(utxos), NUM_TXS // CHAIN_LENGTH)
+        for utxo in utxos:
+            # The last tx of each chain
+            entry = node.getmempoolentry(utxo['txid'])
+            assert_equal(entry['ancestorcount'], CHAIN_LENGTH)
+            assert_equal(entry['descendantcount'], 1)
+            txout = node.gettxout(utxo['txid'], utxo['vout'], True)
+            assert_equal(txout['value'] * COIN, utxo['value_sat'])
+
+        self.log.info("Check that the mempool of the fixture can be mined")
+        node.generate(1)
+        self.sync_all()
+        for node in self.nodes:
+            assert_equal(node.getmempoolinfo()['size'], 0)
+
+
+if __name__ == '__main__':
+    ChainFixtureTest().main()
@@ -42,7 +42,7 @@ class UTXOSetHashTest(BitcoinTestFramework):
 
         # Serialize the outputs that should be in the UTXO set and add them to
         # a MuHash object
-        muhash = MuHash3072()
+        utxos = []
 
         for height, block in enumerate(blocks):
             # The Genesis block coinbase is not part of the UTXO set and we
@@ -61,8 +61,10 @@ class UTXOSetHashTest(BitcoinTestFramework):
                     data += struct.pack("<i", height * 2 + coinbase)
                     data += tx_out.serialize()
 
-                    muhash.insert(data)
+                    utxos.append(data)
 
+        muhash = MuHash3072()
+        muhash.insert_many(utxos)
         finalized = muhash.digest()
         node_muhash = node.gettxoutsetinfo("muhash")['muhash']
 
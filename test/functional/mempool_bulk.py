@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Test the MiniWallet bulk transaction methods.
+
+Create a fan-out tx with create_fan_out() and chains of txs spending its
+outputs with create_bulk_transactions(), send them with send_bulk() and
+check that all of them are accepted into the mempool with the requested
+ancestry and fee rates.
+"""
+
+from decimal import Decimal
+import math
+
+from test_framework.messages import COIN
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal
+from test_framework.wallet import MiniWallet
+
+NUM_OUTPUTS = 50
+NUM_TXS = 120
+CHAIN_LENGTH = 12
+
+
+class MempoolBulkTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.setup_clean_chain = True
+
+    def check_fee_rate(self, entry, fee_rate, *, max_extra_sat=0):
+        """Check that the fee of a mempool entry is its vsize at fee_rate (in BTC/kvB), rounded up to the satoshi.
+
+        max_extra_sat allows for a larger fee, as a fan-out tx pays the
+        remainder of splitting its input value in equal outputs as fee."""
+        fee_sat = int(entry['fees']['base'] * COIN)
+        min_fee_sat = math.ceil(entry['vsize'] * fee_rate * COIN / 1000)
+        assert min_fee_sat <= fee_sat <= min_fee_sat + max_extra_sat, (fee_sat, min_fee_sat)
+
+    def run_test(self):
+        node = self.nodes[0]
+        wallet = MiniWallet(node)
+        wallet.generate(1)
+        node.generate(100)
+
+        self.log.info("Test create_fan_out")
+        fan_out_fee_rate = Decimal("0.0001")
+        fan_out = wallet.create_fan_out(num_outputs=NUM_OUTPUTS, fee_rate=fan_out_fee_rate)
+        assert_equal(len(fan_out['tx'].vout), NUM_OUTPUTS)
+        assert_equal(len({txout.nValue for txout in fan_out['tx'].vout}), 1)
+        assert_equal(wallet.get_bulk_utxo_count(), NUM_OUTPUTS)
+        assert_equal(wallet.send_bulk(from_node=node, txs=[fan_out]), [fan_out['txid']])
+        assert_equal(node.getmempoolentry(fan_out['txid'])['wtxid'], fan_out['wtxid'])
+        self.check_fee_rate(node.getmempoolentry(fan_out['txid']), fan_out_fee_rate, max_extra_sat=NUM_OUTPUTS - 1)
+        # Confirm the fan-out tx, as the chains below would exceed its descendant limit
+        node.generate(1)
+        assert_equal(node.getmempoolinfo()['size'], 0)
+
+        self.log.info("Test create_bulk_transactions")
+        fee_rate = Decimal("0.00002")
+        txs = wallet.create_bulk_transactions(NUM_TXS, chain_length=CHAIN_LENGTH, fee_rate=fee_rate)
+        assert_equal(len(txs), NUM_TXS)
+        # Each chain spends one fan-out output, the outputs of the chains are not bulk utxos
+        assert_equal(wallet.get_bulk_utxo_count(), NUM_OUTPUTS - NUM_TXS // CHAIN_LENGTH)
+        for i, tx in enumerate(txs):
+            assert_equal(len(tx['tx'].vin), 1)
+            assert_equal(len(tx['tx'].vout), 1)
+            parent = fan_out if i % CHAIN_LENGTH == 0 else txs[i - 1]
+            assert_equal(tx['tx'].vin[0].prevout.hash, int(parent['txid'], 16))
+
+        self.log.info("Test send_bulk")
+        # A chunk size that does not divide the chain length, so that chains span several chunks
+        txids = wallet.send_bulk(from_node=node, txs=txs, chunk_size=7)
+        assert_equal(txids, [tx['txid'] for tx in txs])
+        assert_equal(set(node.getrawmempool()), set(txids))
+
+        self.log.info("Check the ancestry and the fee rates of the mempool entries")
+        for i, tx in enumerate(txs):
+            entry = node.getmempoolentry(tx['txid'])
+            self.check_fee_rate(entry, fee_rate)
+            # The previous txs of the chain are the ancestors, the next ones the descendants
+            assert_equal(entry['ancestorcount'], i % CHAIN_LENGTH + 1)
+            assert_equal(entry['descendantcount'], CHAIN_LENGTH - i % CHAIN_LENGTH)
+            assert_equal(entry['wtxid'], tx['wtxid'])
+
+        self.log.info("Check that independent txs only spend confirmed outputs")
+        independent_txs = wallet.create_bulk_transactions(wallet.get_bulk_utxo_count(), fee_rate=fee_rate)
+        assert_equal(len(independent_txs), NUM_OUTPUTS - NUM_TXS // CHAIN_LENGTH)
+        for tx in independent_txs:
+            prevout = tx['tx'].vin[0].prevout
+            assert_equal(prevout.hash, int(fan_out['txid'], 16))
+            # Without the mempool, so that an output of an unconfirmed tx is not found
+            assert_equal(node.gettxout('%064x' % prevout.hash, prevout.n, False)['confirmations'], 1)
+        independent_txids = wallet.send_bulk(from_node=node, txs=independent_txs)
+        for txid in independent_txids:
+            entry = node.getmempoolentry(txid)
+            assert_equal((entry['ancestorcount'], entry['descendantcount']), (1, 1))
+        assert_equal(wallet.get_bulk_utxo_count(), 0)
+
+        self.log.info("Check that the txs can be mined")
+        block = node.getblock(node.generate(1)[0])
+        assert_equal(node.getmempoolinfo()['size'], 0)
+        assert_equal(set(block['tx'][1:]), set(txids + independent_txids))
+
+
+if __name__ == '__main__':
+    MempoolBulkTest().main()
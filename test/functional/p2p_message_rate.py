@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Benchmark how fast the node processes P2P messages.
+
+For each message type (tx, inv, headers and cmpctblock), this test:
+
+- precomputes the messages and serializes them with build_message() so
+  that the Python side does no work while measuring
+- blasts --count messages over send_raw_message() followed by a single
+  ping, and measures the time until the pong comes back (the node processes
+  messages from a peer in order, so the pong means all messages are processed)
+- checks how many messages the node accepted (mempool size for tx, header
+  count for headers, block count for cmpctblock)
+- measures the round-trip latency of --latency-samples single messages, each
+  followed by a ping
+
+and logs the throughput and the latency percentiles per message type.
+
+This is not run by default. Example:
+
+    test/functional/p2p_message_rate.py --count=5000 --msgtypes=tx,headers
+"""
+
+import math
+import random
+import time
+
+from test_framework.blocktools import (
+    create_block,
+    create_coinbase,
+)
+from test_framework.messages import (
+    CBlockHeader,
+    CInv,
+    HeaderAndShortIDs,
+    MSG_WTX,
+    msg_cmpctblock,
+    msg_headers,
+    msg_inv,
+    msg_ping,
+    msg_tx,
+)
+from test_framework.p2p import (
+    P2PInterface,
+    p2p_lock,
+)
+from test_framework.test_framework import BitcoinTestFramework
+from test_framework.util import assert_equal
+from test_framework.wallet import MiniWallet
+
+BENCH_MSGTYPES = ["tx", "inv", "cmpctblock", "headers"]
+# Number of outputs per fan-out transaction used to fund the benchmark txs.
+# Keeps the fan-out tx below the standard weight limit.
+FANOUT_OUTPUTS = 1000
+VERSIONBITS_TOP_BITS = 0x20000000
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float('nan')
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class BenchPeer(P2PInterface):
+    """A peer that only decodes handshake and ping/pong messages and records pong arrival times."""
+
+    def __init__(self):
+        super().__init__(decode_msgtypes=[], drop_undecoded=True)
+        self.pong_times = {}
+
+    def on_pong(self, message):
+        self.pong_times[message.nonce] = time.time()
+
+
+class P2PMessageRateTest(BitcoinTestFramework):
+    def set_test_params(self):
+        self.num_nodes = 1
+        self.setup_clean_chain = True
+        # noban so that the node never disconnects or discourages the benchmark peer
+        self.extra_args = [["-whitelist=noban@127.0.0.1"]]
+
+    def add_options(self, parser):
+        parser.add_argument("--count", dest="count", default=1000, type=int,
+                            help="Number of messages of each type to send in the throughput run (default: %(default)s)")
+        parser.add_argument("--latency-samples", dest="latency_samples", default=100, type=int,
+                            help="Number of single-message round trips to measure per message type (default: %(default)s)")
+        parser.add_argument("--msgtypes", dest="msgtypes", default=",".join(BENCH_MSGTYPES),
+                            help="Comma separated list of message types to benchmark (default: %(default)s)")
+
+    def run_test(self):
+        node = self.nodes[0]
+        msgtypes = self.options.msgtypes.split(",")
+        for msgtype in msgtypes:
+            assert msgtype in BENCH_MSGTYPES, "Unknown message type {}".format(msgtype)
+
+        self.log.info("Generate coins to fund the benchmark txs")
+        self.wallet = MiniWallet(node)
+        self.wallet.generate(math.ceil((self.options.count + self.options.latency_samples) / FANOUT_OUTPUTS))
+        node.generate(100)
+        self.peer = node.add_p2p_connection(BenchPeer())
+        self.nonce = 1 << 32
+
+        results = []
+        # Keep the order of BENCH_MSGTYPES: cmpctblock must move the tip before
+        # headers builds its chain on top of it.
+        for msgtype in [m for m in BENCH_MSGTYPES if m in msgtypes]:
+            self.log.info("Precompute {} {} messages".format(self.options.count + self.options.latency_samples, msgtype))
+            messages, accepted = getattr(self, "prepare_" + msgtype)(self.options.count + self.options.latency_samples)
+            raw_messages = [self.peer.build_message(m) for m in messages]
+            self.log.info("Benchmark {} messages".format(msgtype))
+            results.append(self.run_benchmark(msgtype, raw_messages, accepted))
+
+        self.log.info("Results:")
+        self.log.info("{:>12} {:>8} {:>10} {:>12} {:>9} {:>9} {:>9} {:>9}".format(
+            "msgtype", "count", "seconds", "msgs/s", "accepted", "p50 ms", "p90 ms", "p99 ms"))
+        for r in results:
+            self.log.info("{msgtype:>12} {count:>8} {seconds:>10.3f} {rate:>12.1f} {accepted:>9} {p50:>9.3f} {p90:>9.3f} {p99:>9.3f}".format(**r))
+
+    def send_ping(self):
+        """Send a ping with a fresh nonce and return that nonce."""
+        self.nonce += 1
+        self.peer.send_raw_message(self.peer.build_message(msg_ping(nonce=self.nonce)))
+        return self.nonce
+
+    def wait_for_pong(self, nonce):
+        self.peer.wait_until(lambda: nonce in self.peer.pong_times, timeout=600)
+        with p2p_lock:
+            return self.peer.pong_times.pop(nonce)
+
+    def run_benchmark(self, msgtype, raw_messages, accepted):
+        count = self.options.count
+        before = accepted()
+
+        t_start = time.time()
+        for raw_message in raw_messages[:count]:
+            self.peer.send_raw_message(raw_message)
+        nonce = self.send_ping()
+        t_end = self.wait_for_pong(nonce)
+        seconds = t_end - t_start
+        num_accepted = None if before is None else accepted() - before
+
+        latencies = []
+        for raw_message in raw_messages[count:]:
+            t_send = time.time()
+            self.peer.send_raw_message(raw_message)
+            nonce = self.send_ping()
+            latencies.append((self.wait_for_pong(nonce) - t_send) * 1000)
+        latencies.sort()
+
+        return {
+            "msgtype": msgtype,
+            "count": count,
+            "seconds": seconds,
+            "rate": count / seconds if seconds else float('inf'),
+            "accepted": "-" if num_accepted is None else num_accepted,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+        }
+
+    def prepare_tx(self, num):
+        """Return num independent, valid txs spending confirmed fan-out outputs."""
+        node = self.nodes[0]
+        fanouts = []
+        for i in range(0, num, FANOUT_OUTPUTS):
+            fanouts.append(self.wallet.create_fan_out(num_outputs=min(FANOUT_OUTPUTS, num - i)))
+        self.wallet.send_bulk(from_node=node, txs=fanouts)
+        # Confirm the fan-out txs so that the benchmark txs have no mempool ancestors
+        node.generate(1)
+        assert_equal(node.getmempoolinfo()['size'], 0)
+        # Each tx spends its own fan-out output
+        txs = self.wallet.create_bulk_transactions(num)
+        return [msg_tx(tx['tx']) for tx in txs], lambda: node.getmempoolinfo()['size']
+
+    def prepare_inv(self, num):
+        """Return num inv messages announcing unknown wtxids."""
+        return [msg_inv([CInv(MSG_WTX, random.getrandbits(256))]) for _ in range(num)], lambda: None
+
+    def build_chain(self, num):
+        """Return num solved, coinbase-only blocks building on the current tip.
+
+        The block times increase by one second per block, so the node's mocktime
+        is moved up to the time of the last block. Otherwise a large --count
+        would build blocks more than MAX_FUTURE_BLOCK_TIME ahead of the node's
+        clock, which it rejects as time-too-new."""
+        node = self.nodes[0]
+        tip = node.getblockheader(node.getbestblockhash())
+        prev_hash, height, block_time = int(tip['hash'], 16), tip['height'] + 1, tip['time'] + 1
+        blocks = []
+        for _ in range(num):
+            block = create_block(prev_hash, create_coinbase(height), block_time, version=VERSIONBITS_TOP_BITS)
+            block.solve()
+            blocks.append(block)
+            prev_hash, height, block_time = block.sha256, height + 1, block_time + 1
+        node.setmocktime(max(int(time.time()), block_time))
+        return blocks
+
+    def prepare_cmpctblock(self, num):
+        """Return num compact blocks that each extend the chain by one block."""
+        node = self.nodes[0]
+        messages = []
+        for block in self.build_chain(num):
+            cmpct = HeaderAndShortIDs()
+            cmpct.initialize_from_block(block, use_witness=True)
+            messages.append(msg_cmpctblock(cmpct.to_p2p()))
+        return messages, lambda: node.getblockcount()
+
+    def prepare_headers(self, num):
+        """Return num headers messages that each extend the header chain by one header."""
+        node = self.nodes[0]
+        return [msg_headers([CBlockHeader(block)]) for block in self.build_chain(num)], lambda: node.getblockchaininfo()['headers']
+
+
+if __name__ == '__main__':
+    P2PMessageRateTest().main()
@@ -65,8 +65,7 @@ class TxDownloadTest(BitcoinTestFramework):
 
         self.log.info("Announce the txid from each incoming peer to node 0")
         msg = msg_inv([CInv(t=MSG_WTX, h=txid)])
-        for p in self.nodes[0].p2ps:
-            p.send_and_ping(msg)
+        self.swarms[0].send_and_ping(msg)
 
         outstanding_peer_index = [i for i in range(len(self.nodes[0].p2ps))]
 
@@ -106,8 +105,8 @@ class TxDownloadTest(BitcoinTestFramework):
         self.log.info(
             "Announce the transaction to all nodes from all {} incoming peers, but never send it".format(NUM_INBOUND))
         msg = msg_inv([CInv(t=MSG_TX, h=txid)])
-        for p in self.peers:
-            p.send_and_ping(msg)
+        for swarm in self.swarms:
+            swarm.send_and_ping(msg)
 
         self.log.info("Put the tx in node 0's mempool")
         self.nodes[0].sendrawtransaction(tx)
@@ -274,10 +273,9 @@ class TxDownloadTest(BitcoinTestFramework):
             self.start_nodes()
             self.connect_nodes(1, 0)
             # Setup the p2p connections
-            self.peers = []
+            self.swarms = [node.add_p2p_swarm(NUM_INBOUND, TestP2PConn) for node in self.nodes]
             for node in self.nodes:
-                for _ in range(NUM_INBOUND):
-                    self.peers.append(node.add_p2p_connection(TestP2PConn()))
+                assert_equal(len(node.getpeerinfo()), NUM_INBOUND + 1)
             self.log.info("Nodes are setup with {} incoming connections each".format(NUM_INBOUND))
             test()
 
@@ -6,6 +6,7 @@
 """
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import assert_equal, assert_raises_rpc_error
+from test_framework.utxo_snapshot import snapshot_stats
 
 import hashlib
 from pathlib import Path
@@ -43,6 +44,13 @@ class DumptxoutsetTest(BitcoinTestFramework):
             assert_equal(
                 digest, '7ae82c986fa5445678d2a21453bb1c86d39e47af13da137640c2b1cf8093691c')
 
+        self.log.info("Check the UTXO set hash and statistics of the snapshot")
+        stats = snapshot_stats(str(expected_path))
+        txoutset_info = node.gettxoutsetinfo("muhash")
+        assert_equal(stats['base_hash'], txoutset_info['bestblock'])
+        for field in ['txouts', 'transactions', 'bogosize', 'total_amount', 'muhash']:
+            assert_equal(stats[field], txoutset_info[field])
+
         # Specifying a path to an existing file will fail.
         assert_raises_rpc_error(
             -8, '{} already exists'.format(FILENAME),  node.dumptxoutset, FILENAME)
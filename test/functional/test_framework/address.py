@@ -8,10 +8,24 @@
 - bech32 segwit v0 P2WPKH and P2WSH addresses."""
 
 import enum
+import functools
 import unittest
 
-from .script import hash256, hash160, sha256, CScript, OP_0
-from .segwit_addr import encode_segwit_address
+from .script import (
+    CScript,
+    OP_0,
+    OP_1,
+    OP_CHECKSIG,
+    OP_DUP,
+    OP_EQUAL,
+    OP_EQUALVERIFY,
+    OP_HASH160,
+    OP_TRUE,
+    hash160,
+    hash256,
+    sha256,
+)
+from .segwit_addr import encode_segwit_address, encode_segwit_addresses
 from .util import assert_equal, hex_str_to_bytes
 
 ADDRESS_BCRT1_UNSPENDABLE = 'bcrt1qqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqqq3xueyj'
@@ -27,22 +41,30 @@ class AddressType(enum.Enum):
 
 
 chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+# Base58 is converted two digits at a time: base58_pairs[n] is the two-digit
+# encoding of n < 58**2, and base58_pair_values is its inverse (including the
+# one-digit encodings).
+base58_pairs = [a + b for a in chars for b in chars]
+base58_pair_values = {pair: n for n, pair in enumerate(base58_pairs)}
+base58_pair_values.update({c: n for n, c in enumerate(chars)})
+base58_chars = frozenset(chars)
+# Number of output scripts whose addresses are cached by output_script_to_address()
+ADDRESS_CACHE_SIZE = 1 << 16
 
 
 def byte_to_base58(b, version):
-    result = ''
-    str = b.hex()
-    str = chr(version).encode('latin-1').hex() + str
-    checksum = hash256(hex_str_to_bytes(str)).hex()
-    str += checksum[:8]
-    value = int('0x' + str, 0)
+    data = bytes([version]) + b
+    data += hash256(data)[:4]
+    value = int.from_bytes(data, 'big')
+    pairs = []
     while value > 0:
-        result = chars[value % 58] + result
-        value //= 58
-    while (str[:2] == '00'):
-        result = chars[0] + result
-        str = str[2:]
-    return result
+        value, pair = divmod(value, 58 * 58)
+        pairs.append(base58_pairs[pair])
+    result = ''.join(reversed(pairs))
+    if result[:1] == chars[0]:
+        # The leading digit of the most significant pair is zero
+        result = result[1:]
+    return chars[0] * (len(data) - len(data.lstrip(b'\x00'))) + result
 
 
 def base58_to_byte(s):
@@ -51,22 +73,12 @@ def base58_to_byte(s):
     Throws if the base58 checksum is invalid."""
     if not s:
         return b''
-    n = 0
-    for c in s:
-        n *= 58
-        assert c in chars
-        digit = chars.index(c)
-        n += digit
-    h = '%x' % n
-    if len(h) % 2:
-        h = '0' + h
+    assert base58_chars.issuperset(s)
+    n = base58_pair_values[s[:len(s) % 2]] if len(s) % 2 else 0
+    for i in range(len(s) % 2, len(s), 2):
+        n = n * (58 * 58) + base58_pair_values[s[i:i + 2]]
     res = n.to_bytes((n.bit_length() + 7) // 8, 'big')
-    pad = 0
-    for c in s:
-        if c == chars[0]:
-            pad += 1
-        else:
-            break
+    pad = len(s) - len(s.lstrip(chars[0]))
     res = b'\x00' * pad + res
 
     # Assert if the checksum is invalid
@@ -119,6 +131,72 @@ def script_to_p2sh_p2wsh(script, main=False):
     p2shscript = CScript([OP_0, sha256(script)])
     return script_to_p2sh(p2shscript, main)
 
+def _witness_program(script):
+    """Return the witness version and program of a segwit output script, or None."""
+    if len(script) < 4 or script[1] != len(script) - 2:
+        return None
+    if script[0] == OP_0:
+        version = 0
+    elif 0x51 <= script[0] <= 0x60:  # OP_1 to OP_16
+        version = script[0] - 0x50
+    else:
+        return None
+    program = bytes(script[2:])
+    if not 2 <= len(program) <= 40 or (version == 0 and len(program) not in [20, 32]):
+        return None
+    return version, program
+
+
+def _base58_output_script(script):
+    """Return (hash, is_p2sh) for a P2PKH or P2SH output script, or None."""
+    if len(script) == 25 and script[:3] == b'\x76\xa9\x14' and script[23:] == b'\x88\xac':
+        return script[3:23], False
+    if len(script) == 23 and script[:2] == b'\xa9\x14' and script[22:] == b'\x87':
+        return script[2:22], True
+    return None
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _output_script_to_address(script, main):
+    witness = _witness_program(script)
+    if witness is not None:
+        return program_to_witness(witness[0], witness[1], main)
+    base58 = _base58_output_script(script)
+    if base58 is not None:
+        return scripthash_to_p2sh(base58[0], main) if base58[1] else keyhash_to_p2pkh(base58[0], main)
+    return None
+
+
+def output_script_to_address(script, main=False):
+    """Return the address of a P2PKH, P2SH or segwit output script, or None for other scripts.
+
+    The addresses of the last ADDRESS_CACHE_SIZE distinct scripts are cached."""
+    return _output_script_to_address(bytes(check_script(script)), main)
+
+
+def output_scripts_to_addresses(scripts, main=False):
+    """Return [output_script_to_address(script, main) for script in scripts].
+
+    Each distinct script is converted once, and the segwit addresses are
+    encoded in batches (see encode_segwit_addresses())."""
+    scripts = [bytes(check_script(script)) for script in scripts]
+    addresses = dict.fromkeys(scripts)
+    by_version = {}
+    for script in addresses:
+        witness = _witness_program(script)
+        if witness is not None:
+            by_version.setdefault(witness[0], []).append((script, witness[1]))
+            continue
+        base58 = _base58_output_script(script)
+        if base58 is not None:
+            addresses[script] = scripthash_to_p2sh(base58[0], main) if base58[1] else keyhash_to_p2pkh(base58[0], main)
+    for version, items in by_version.items():
+        encoded = encode_segwit_addresses("bc" if main else "bcrt", version, [program for _, program in items])
+        for (script, _), address in zip(items, encoded):
+            addresses[script] = address
+    return [addresses[script] for script in scripts]
+
+
 def check_key(key):
     if (type(key) is str):
         key = hex_str_to_bytes(key)  # Assuming this is hex string
@@ -151,3 +229,27 @@ class TestFrameworkScript(unittest.TestCase):
         check_base58(bytes.fromhex('0041c1eaf111802559bad61b60d62b1f897c63928a'), 0)
         check_base58(bytes.fromhex('000041c1eaf111802559bad61b60d62b1f897c63928a'), 0)
         check_base58(bytes.fromhex('00000041c1eaf111802559bad61b60d62b1f897c63928a'), 0)
+
+    def test_output_script_to_address(self):
+        keyhash = bytes.fromhex('1f8ea1702a7bd4941bca0941b852c4bbfedb2e05')
+        scripts = [
+            CScript([OP_DUP, OP_HASH160, keyhash, OP_EQUALVERIFY, OP_CHECKSIG]),
+            CScript([OP_HASH160, keyhash, OP_EQUAL]),
+            CScript([OP_0, keyhash]),
+            CScript([OP_0, bytes(32)]),
+            CScript([OP_1, bytes(range(32))]),
+            CScript([OP_0, bytes(21)]),
+            CScript([OP_TRUE]),
+        ]
+        expected = [
+            keyhash_to_p2pkh(keyhash),
+            scripthash_to_p2sh(keyhash),
+            program_to_witness(0, keyhash),
+            ADDRESS_BCRT1_UNSPENDABLE,
+            program_to_witness(1, bytes(range(32))),
+            None,
+            None,
+        ]
+        self.assertEqual([output_script_to_address(script) for script in scripts], expected)
+        self.assertEqual(output_scripts_to_addresses(scripts * 2), expected * 2)
+        self.assertEqual(output_script_to_address(scripts[0].hex(), main=True), keyhash_to_p2pkh(keyhash, main=True))
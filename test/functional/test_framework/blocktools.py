@@ -5,6 +5,10 @@
 """Utilities for manipulating blocks and transactions."""
 
 from binascii import a2b_hex
+import collections
+import concurrent.futures
+import functools
+import itertools
 import struct
 import time
 import unittest
@@ -17,6 +21,7 @@ from .address import (
 )
 from .messages import (
     CBlock,
+    CBlockHeader,
     COIN,
     COutPoint,
     CTransaction,
@@ -28,6 +33,7 @@ from .messages import (
     hash256,
     hex_str_to_bytes,
     ser_uint256,
+    ser_compact_size,
     sha256,
     uint256_from_str,
 )
@@ -49,8 +55,20 @@ WITNESS_SCALE_FACTOR = 4
 MAX_BLOCK_SIGOPS = 20000
 MAX_BLOCK_SIGOPS_WEIGHT = MAX_BLOCK_SIGOPS * WITNESS_SCALE_FACTOR
 
+# Coinbase outputs can be spent in blocks at least this many blocks after the coinbase
+COINBASE_MATURITY = 100
+# nVersion of the blocks built by ChainBuilder (BIP9 top bits, no signalling)
+VERSIONBITS_TOP_BITS = 0x20000000
+# Number of blocks ChainBuilder builds ahead of the consumer when using worker processes
+CHAIN_BUILDER_WINDOW = 64
+# Number of blocks per submitblock batch. Keeps batches of full blocks below
+# the maximum size of an HTTP request body of the RPC server (32MB).
+SUBMIT_BLOCK_CHUNK_SIZE = 10
+
 # Genesis block time (regtest)
 TIME_GENESIS_BLOCK = 1296688602
+# Blocks with a time more than this many seconds ahead of the node's clock are rejected
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
 
 # From BIP141
 WITNESS_COMMITMENT_HEADER = b"\xaa\x21\xa9\xed"
@@ -246,8 +264,217 @@ def send_to_witness(use_p2wsh, node, utxo, pubkey, encode_p2sh, amount, sign=Tru
 
     return node.sendrawtransaction(tx_to_witness)
 
+def _build_block_txs(height, *, first_height, txs_per_block, padding):
+    """Return the merkle root and the serialized transactions of the ChainBuilder block at height.
+
+    The transactions of a block only depend on its height, so that the
+    blocks can be built in any order, by any worker process."""
+    coinbase = create_coinbase(height)
+    txs_ser = [coinbase.serialize()]
+    hashes = [ser_uint256(coinbase.sha256)]
+    if height - COINBASE_MATURITY >= first_height:
+        # Chain of transactions spending the coinbase of a block built by the same ChainBuilder
+        prev_coinbase = create_coinbase(height - COINBASE_MATURITY)
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(prev_coinbase.sha256, 0))]
+        tx.vout = [CTxOut(prev_coinbase.vout[0].nValue, CScript([OP_TRUE]))] + padding
+        for _ in range(txs_per_block):
+            tx_ser = tx.serialize()
+            txid = hash256(tx_ser)
+            txs_ser.append(tx_ser)
+            hashes.append(txid)
+            tx.vin[0].prevout = COutPoint(uint256_from_str(txid), 0)
+    return CBlock.get_merkle_root(hashes), ser_compact_size(len(txs_ser)) + b"".join(txs_ser)
+
+
+class PrebuiltBlock(CBlockHeader):
+    """A block header together with the serialized transactions of the block, as built by ChainBuilder.
+
+    Can be passed to submitblock (serialize().hex()) and to P2PDataStore in
+    place of a CBlock, without deserializing the transactions."""
+    __slots__ = ("vtx_ser",)
+
+    def __init__(self, vtx_ser):
+        super().__init__()
+        self.vtx_ser = vtx_ser
+
+    def serialize(self, with_witness=True):
+        return super().serialize() + self.vtx_ser
+
+    solve = CBlock.solve
+
+    def get_block(self):
+        """Return the block as a CBlock."""
+        return FromHex(CBlock(), self.serialize().hex())
+
+
+class ChainBuilder():
+    """Build a chain of regtest blocks on top of a given tip, without a wallet or mining RPCs.
+
+    Each block has an anyone-can-spend coinbase. Once the coinbases of the
+    chain are mature, every block also contains a chain of txs_per_block
+    transactions spending the coinbase of the block COINBASE_MATURITY blocks
+    earlier, each with the outputs in padding appended to make it large.
+    txs_per_block=14 and padding=gen_return_txouts() give blocks of about
+    1MB, like util.mine_large_block(). The transactions pay no fee and have
+    no witness, so that the coinbases and the transactions only depend on
+    the height of the block.
+
+    The coinbases, transactions and merkle roots are built by the given
+    number of worker processes. The headers are then solved in order, as each one
+    commits to the hash of the previous one, which takes two attempts on
+    average with the regtest difficulty."""
+    def __init__(self, tip_hash, tip_height, tip_time, *, txs_per_block=0, padding=None, processes=1):
+        self.tip_hash = tip_hash
+        self.tip_height = tip_height
+        self.tip_time = tip_time
+        self.build_block_txs = functools.partial(
+            _build_block_txs, first_height=tip_height + 1, txs_per_block=txs_per_block, padding=padding or [])
+        self.processes = processes
+
+    @classmethod
+    def from_node(cls, node, **kwargs):
+        """Return a ChainBuilder for the tip of node."""
+        tip = node.getblockheader(node.getbestblockhash())
+        return cls(int(tip['hash'], 16), tip['height'], tip['time'], **kwargs)
+
+    def _block_txs(self, heights):
+        if self.processes <= 1:
+            yield from map(self.build_block_txs, heights)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.processes) as executor:
+            pending = collections.deque(executor.submit(self.build_block_txs, height) for height in itertools.islice(heights, CHAIN_BUILDER_WINDOW))
+            while pending:
+                result = pending.popleft().result()
+                for height in itertools.islice(heights, 1):
+                    pending.append(executor.submit(self.build_block_txs, height))
+                yield result
+
+    def build(self, num_blocks):
+        """Yield num_blocks solved PrebuiltBlocks extending the tip, which is updated as they are yielded."""
+        heights = iter(range(self.tip_height + 1, self.tip_height + 1 + num_blocks))
+        for merkle_root, vtx_ser in self._block_txs(heights):
+            block = PrebuiltBlock(vtx_ser)
+            block.nVersion = VERSIONBITS_TOP_BITS
+            block.hashPrevBlock = self.tip_hash
+            block.hashMerkleRoot = merkle_root
+            block.nTime = self.tip_time + 1
+            block.nBits = 0x207fffff  # difficulty retargeting is disabled in REGTEST chainparams
+            block.solve()
+            self.tip_hash = block.sha256
+            self.tip_height += 1
+            self.tip_time += 1
+            yield block
+
+    def submit(self, node, num_blocks, *, p2p=None, chunk_size=SUBMIT_BLOCK_CHUNK_SIZE, set_mocktime=False):
+        """Build num_blocks blocks and submit them to node, in chunks of chunk_size blocks.
+
+        The blocks are submitted in submitblock batches, or with
+        p2p.send_blocks_and_test() if a P2PDataStore is given.
+
+        The blocks are one second apart, so that a chain of more than
+        MAX_FUTURE_BLOCK_TIME blocks from a current tip ends up too far in
+        the future for the node (time-too-new). With set_mocktime, the
+        mocktime of node is set to the time of the last block first. It is
+        not restored: the clock of the node stays at that time until the
+        test changes it (setmocktime(0) resets it to the system time)."""
+        if set_mocktime:
+            node.setmocktime(self.tip_time + num_blocks)
+        blocks = self.build(num_blocks)
+        if p2p is not None:
+            for chunk in iter(lambda: list(itertools.islice(blocks, chunk_size)), []):
+                p2p.send_blocks_and_test(chunk, node)
+            return
+        requests = (node.submitblock.get_request(block.serialize().hex()) for block in blocks)
+        for result in node.batch_execute(requests, chunk_size=chunk_size, max_in_flight=1):
+            assert_equal(result, None)
+        assert_equal(node.getbestblockhash(), '%064x' % self.tip_hash)
+
+
 class TestFrameworkBlockTools(unittest.TestCase):
     def test_create_coinbase(self):
         height = 20
         coinbase_tx = create_coinbase(height=height)
         assert_equal(CScriptNum.decode(coinbase_tx.vin[0].scriptSig), height)
+
+    def test_chain_builder(self):
+        tip_hash, tip_height = 0x1234, 200
+        padding = [CTxOut(0, CScript([OP_RETURN, b'\x01' * 80]))] * 3
+        builder = ChainBuilder(tip_hash, tip_height, TIME_GENESIS_BLOCK, txs_per_block=2, padding=padding)
+        blocks = list(builder.build(COINBASE_MATURITY + 2))
+        assert_equal(builder.tip_height, tip_height + COINBASE_MATURITY + 2)
+        assert_equal(builder.tip_hash, blocks[-1].sha256)
+        prev_hash = tip_hash
+        for height, prebuilt in enumerate(blocks, start=tip_height + 1):
+            block = prebuilt.get_block()
+            block.rehash()
+            assert_equal(block.serialize(), prebuilt.serialize())
+            assert_equal(block.hashPrevBlock, prev_hash)
+            assert_equal(block.sha256, prebuilt.sha256)
+            assert block.is_valid()
+            assert_equal(CScriptNum.decode(block.vtx[0].vin[0].scriptSig), height)
+            assert_equal(len(block.vtx), 1 if height <= tip_height + COINBASE_MATURITY else 3)
+            prev_hash = block.sha256
+        # The transactions of the last block spend the coinbase of block 2
+        block = blocks[-1].get_block()
+        coinbase = blocks[1].get_block().vtx[0]
+        coinbase.calc_sha256()
+        block.vtx[1].calc_sha256()
+        assert_equal(block.vtx[1].vin[0].prevout.hash, coinbase.sha256)
+        assert_equal(block.vtx[2].vin[0].prevout.hash, block.vtx[1].sha256)
+        assert_equal([txout.serialize() for txout in block.vtx[2].vout[1:]], [txout.serialize() for txout in padding])
+        # Worker processes build the same chain
+        builder = ChainBuilder(tip_hash, tip_height, TIME_GENESIS_BLOCK, txs_per_block=2, padding=padding, processes=2)
+        assert_equal([b.serialize() for b in builder.build(COINBASE_MATURITY + 2)], [b.serialize() for b in blocks])
+
+    def test_chain_builder_submit(self):
+        from .authproxy import AuthServiceProxy, TestFrameworkAuthProxy
+        submitted = []
+        mocktimes = []
+
+        def submitblock(block_hex):
+            block = FromHex(CBlock(), block_hex)
+            block.rehash()
+            submitted.append(block)
+
+        server = TestFrameworkAuthProxy.MockRPCServer(methods={
+            'submitblock': submitblock,
+            'getbestblockhash': lambda: submitted[-1].hash,
+            'setmocktime': mocktimes.append,
+        })
+        node = AuthServiceProxy(server.url)
+        try:
+            # Over RPC, in submitblock batches of chunk_size blocks
+            builder = ChainBuilder(0x1234, 200, TIME_GENESIS_BLOCK)
+            builder.submit(node, 25)
+            assert_equal([len(body) for _, body in server.requests if isinstance(body, list)], [10, 10, 5])
+            assert_equal([block.hashPrevBlock for block in submitted], [0x1234] + [block.sha256 for block in submitted[:-1]])
+            assert_equal(submitted[-1].sha256, builder.tip_hash)
+            assert_equal(submitted[-1].nTime, TIME_GENESIS_BLOCK + 25)
+            # The mocktime is only set when asked to
+            assert_equal(mocktimes, [])
+
+            # Over P2P, in chunks of chunk_size blocks
+            class P2PStore:
+                def __init__(self):
+                    self.chunks = []
+                    self.nodes = []
+
+                def send_blocks_and_test(self, blocks, node):
+                    self.chunks.append(blocks)
+                    self.nodes.append(node)
+
+            p2p = P2PStore()
+            tip_time = int(time.time()) + MAX_FUTURE_BLOCK_TIME
+            builder = ChainBuilder(builder.tip_hash, builder.tip_height, tip_time)
+            builder.submit(node, 7, p2p=p2p, chunk_size=3, set_mocktime=True)
+            assert_equal([len(chunk) for chunk in p2p.chunks], [3, 3, 1])
+            assert all(n is node for n in p2p.nodes)
+            blocks = [block for chunk in p2p.chunks for block in chunk]
+            assert_equal([block.hashPrevBlock for block in blocks], [submitted[-1].sha256] + [block.sha256 for block in blocks[:-1]])
+            assert_equal(blocks[-1].sha256, builder.tip_hash)
+            assert_equal(mocktimes, [tip_time + 7])
+            assert_equal(blocks[-1].nTime, tip_time + 7)
+        finally:
+            node.close()
+            server.stop()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Named, parameterized chain state fixtures.
+
+A ChainFixture describes a chain state, e.g. "5000 mature OP_TRUE UTXOs" or
+"a mempool with 10000 chained transactions", by a name, a build function and
+its parameters. A test uses it by setting self.chain_fixture in
+set_test_params(). The first test that needs the fixture builds it on a node
+started from the 199-block cache and stores the resulting datadir in the
+cache directory, keyed by a hash of the fixture definition. All other tests
+of the test_runner.py invocation copy it into their node datadirs instead of
+building it again (see BitcoinTestFramework._initialize_chain()).
+"""
+
+import ast
+import functools
+import hashlib
+import importlib.util
+import inspect
+import json
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+from .wallet import MiniWallet
+
+# Number of outputs per fan-out transaction. Keeps the transactions below the
+# standard weight limit.
+FANOUT_OUTPUTS = 1000
+
+
+class ChainFixture():
+    """A chain state built by build(node, **params) on a node started from the 199-block cache.
+
+    The blocks, chainstate, indexes and mempool (mempool.dat) of the node
+    are cached and copied to every node of the test. build may return data
+    for the test, such as a list of UTXOs, which is stored as JSON and
+    available as self.fixture_data in the test. Amounts should be returned
+    in satoshis, since JSON floats are not exact.
+
+    The blocks built by build should have the current time (the default),
+    so that the nodes are out of IBD when the test starts."""
+    def __init__(self, name, build, *, extra_args=None, **params):
+        self.name = name
+        self.build = build
+        self.extra_args = extra_args or []
+        self.params = params
+
+    def key(self):
+        """Return a hash of the fixture definition.
+
+        This includes the source of the module of build and of all
+        test_framework modules it uses, directly or indirectly (e.g.
+        wallet.py), so that a change to the code building the chain
+        invalidates the cached fixture."""
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps([self.name, self.extra_args, self.params], sort_keys=True).encode('utf-8'))
+        for module in source_modules(inspect.getmodule(self.build)):
+            hasher.update(inspect.getsource(module).encode('utf-8'))
+        return hasher.hexdigest()[:16]
+
+    def dirname(self):
+        return "fixture_{}_{}".format(self.name, self.key())
+
+
+@functools.lru_cache(maxsize=None)
+def source_modules(module):
+    """Return module and the test_framework modules it imports, directly or indirectly, sorted by name."""
+    modules = {}
+    todo = [module]
+    while todo:
+        module = todo.pop()
+        if module.__name__ in modules:
+            continue
+        modules[module.__name__] = module
+        for node in ast.walk(ast.parse(inspect.getsource(module))):
+            if isinstance(node, ast.ImportFrom):
+                base = importlib.util.resolve_name("." * node.level + (node.module or ""), module.__package__)
+                if base == __package__:
+                    # from . import x
+                    names = [base + "." + alias.name for alias in node.names]
+                else:
+                    names = [base]
+            elif isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            else:
+                continue
+            todo.extend(importlib.import_module(name) for name in names if name.startswith(__package__ + "."))
+    return tuple(modules[name] for name in sorted(modules))
+
+
+def get_fixture_dir(cachedir, fixture, build_datadir):
+    """Return the directory of fixture in cachedir, building it first if it does not exist yet.
+
+    build_datadir(build_dir) must build the fixture datadir in build_dir and
+    return its path. It is moved into place when done, so that tests running
+    in parallel never see a partially built fixture."""
+    fixture_dir = os.path.join(cachedir, fixture.dirname())
+    if os.path.isdir(fixture_dir):
+        return fixture_dir
+
+    build_dir = tempfile.mkdtemp(prefix=fixture.dirname() + ".", dir=cachedir)
+    try:
+        node_dir = build_datadir(build_dir)
+        try:
+            os.rename(node_dir, fixture_dir)
+        except OSError:
+            # Built by another test in the meantime
+            assert os.path.isdir(fixture_dir)
+    finally:
+        shutil.rmtree(build_dir)
+    return fixture_dir
+
+
+def _utxo(tx_info, n):
+    return {'txid': tx_info['txid'], 'vout': n, 'value_sat': tx_info['tx'].vout[n].nValue}
+
+
+def _fan_out(node, num_utxos):
+    """Mine coinbases to the MiniWallet P2WSH OP_TRUE address and split them into num_utxos confirmed, mature outputs.
+
+    Returns the wallet, with the outputs as its bulk utxos, and the list of
+    outputs as {'txid', 'vout', 'value_sat'} dicts."""
+    wallet = MiniWallet(node)
+    num_fanouts = math.ceil(num_utxos / FANOUT_OUTPUTS)
+    wallet.generate(num_fanouts)
+    node.generate(100)
+    txs = [wallet.create_fan_out(num_outputs=min(FANOUT_OUTPUTS, num_utxos - i * FANOUT_OUTPUTS)) for i in range(num_fanouts)]
+    wallet.send_bulk(from_node=node, txs=txs)
+    node.generate(1)
+    return wallet, [_utxo(tx, n) for tx in txs for n in range(len(tx['tx'].vout))]
+
+
+def build_op_true_utxos(node, *, num_utxos):
+    """Create num_utxos confirmed, spendable MiniWallet (P2WSH OP_TRUE) UTXOs."""
+    return {'utxos': _fan_out(node, num_utxos)[1]}
+
+
+def build_chained_mempool(node, *, num_txs, chain_length):
+    """Fill the mempool with num_txs one-in-one-out MiniWallet transactions, in chains of chain_length.
+
+    Each chain starts at its own confirmed fan-out output, so that the chains
+    are independent. Returns the last output of each chain in 'utxos'."""
+    wallet, _ = _fan_out(node, math.ceil(num_txs / chain_length))
+    txs = wallet.create_bulk_transactions(num_txs, chain_length=chain_length)
+    wallet.send_bulk(from_node=node, txs=txs)
+    tips = txs[chain_length - 1::chain_length]
+    if num_txs % chain_length:
+        tips.append(txs[-1])
+    assert node.getmempoolinfo()['size'] == num_txs
+    return {'utxos': [_utxo(tx, 0) for tx in tips]}
+
+
+def op_true_utxos(num_utxos):
+    """A chain with num_utxos confirmed, spendable MiniWallet UTXOs (on top of the 199-block cache)."""
+    return ChainFixture("op_true_utxos", build_op_true_utxos, num_utxos=num_utxos)
+
+
+def chained_mempool(num_txs, chain_length=25):
+    """A mempool with num_txs MiniWallet transactions in chains of chain_length (see build_chained_mempool())."""
+    return ChainFixture("chained_mempool", build_chained_mempool, num_txs=num_txs, chain_length=chain_length)
+
+
+class TestFrameworkFixtures(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix="test_fixtures.")
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_key(self):
+        self.assertEqual(op_true_utxos(10).key(), op_true_utxos(10).key())
+        self.assertNotEqual(op_true_utxos(10).key(), op_true_utxos(11).key())
+        self.assertNotEqual(chained_mempool(10).key(), chained_mempool(10, chain_length=5).key())
+        self.assertNotEqual(
+            ChainFixture("a", build_op_true_utxos, num_utxos=10).key(),
+            ChainFixture("b", build_op_true_utxos, num_utxos=10).key())
+        self.assertNotEqual(
+            ChainFixture("a", build_op_true_utxos, num_utxos=10).key(),
+            ChainFixture("a", build_op_true_utxos, extra_args=["-par=1"], num_utxos=10).key())
+        self.assertEqual(op_true_utxos(10).dirname(), "fixture_op_true_utxos_" + op_true_utxos(10).key())
+
+        # The code used by the build function is part of the key
+        names = [m.__name__ for m in source_modules(inspect.getmodule(build_op_true_utxos))]
+        for name in ["fixtures", "wallet", "messages", "script", "address", "util"]:
+            self.assertIn(__package__ + "." + name, names)
+        self.assertEqual(names, sorted(set(names)))
+
+    def test_fixture_cache(self):
+        builds = []
+
+        def build_datadir(build_dir):
+            builds.append(build_dir)
+            node_dir = os.path.join(build_dir, "node0")
+            os.mkdir(node_dir)
+            with open(os.path.join(node_dir, "fixture.json"), "w", encoding="utf8") as f:
+                json.dump({'data': len(builds)}, f)
+            return node_dir
+
+        def data(fixture_dir):
+            with open(os.path.join(fixture_dir, "fixture.json"), "r", encoding="utf8") as f:
+                return json.load(f)['data']
+
+        # Miss: the fixture is built and moved into the cache directory
+        fixture_dir = get_fixture_dir(self.cachedir, op_true_utxos(10), build_datadir)
+        self.assertEqual(fixture_dir, os.path.join(self.cachedir, op_true_utxos(10).dirname()))
+        self.assertEqual(data(fixture_dir), 1)
+        self.assertEqual(os.listdir(self.cachedir), [op_true_utxos(10).dirname()])
+
+        # Hit: the cached fixture is returned without building it again
+        self.assertEqual(get_fixture_dir(self.cachedir, op_true_utxos(10), build_datadir), fixture_dir)
+        self.assertEqual(len(builds), 1)
+
+        # A different definition is a miss
+        other_dir = get_fixture_dir(self.cachedir, op_true_utxos(11), build_datadir)
+        self.assertNotEqual(other_dir, fixture_dir)
+        self.assertEqual(data(other_dir), 2)
+
+        # Built by another test in the meantime: the first one wins
+        def build_concurrently(build_dir):
+            node_dir = build_datadir(build_dir)
+            shutil.copytree(node_dir, os.path.join(self.cachedir, chained_mempool(10).dirname()))
+            return node_dir
+
+        mempool_dir = get_fixture_dir(self.cachedir, chained_mempool(10), build_concurrently)
+        self.assertEqual(data(mempool_dir), 3)
+        self.assertEqual(sorted(os.listdir(self.cachedir)), sorted(f.dirname() for f in [op_true_utxos(10), op_true_utxos(11), chained_mempool(10)]))
@@ -6,10 +6,12 @@
 WARNING: This code is slow, uses bad randomness, does not properly protect
 keys, and is trivially vulnerable to side channel attacks. Do not use for
 anything but tests."""
+from collections import OrderedDict
 import csv
 import hashlib
 import os
 import random
+import sys
 import unittest
 
 from .util import modinv
@@ -59,12 +61,38 @@ def modsqrt(a, p):
         return sqrt
     return None
 
+# Window width of the wNAF representation used for variable base points with large scalars
+WNAF_WINDOW = 5
+# Number of scalar bits per window of a fixed base table
+FIXED_BASE_WINDOW = 8
+
+def wnaf(n, w):
+    """Compute the width-w non-adjacent form of a non-negative integer n.
+
+    Returns the list of digits, least significant first. Every non-zero
+    digit is odd and in the range [-(2**(w-1) - 1), 2**(w-1) - 1], and
+    every non-zero digit is followed by at least w - 1 zero digits."""
+    digits = []
+    while n:
+        if n & 1:
+            d = n & ((1 << w) - 1)
+            if d >= 1 << (w - 1):
+                d -= 1 << w
+            n -= d
+        else:
+            d = 0
+        digits.append(d)
+        n >>= 1
+    return digits
+
 class EllipticCurve:
     def __init__(self, p, a, b):
         """Initialize elliptic curve y^2 = x^3 + a*x + b over GF(p)."""
         self.p = p
         self.a = a % p
         self.b = b % p
+        # Fixed base points (see set_fixed_base), mapping to their (lazily computed) tables
+        self.fixed_bases = {}
 
     def affine(self, p1):
         """Convert a Jacobian point tuple p1 to affine form, or None if at infinity.
@@ -73,11 +101,39 @@ class EllipticCurve:
         x1, y1, z1 = p1
         if z1 == 0:
             return None
+        if z1 == 1:
+            return p1
         inv = modinv(z1, self.p)
         inv_2 = (inv**2) % self.p
         inv_3 = (inv_2 * inv) % self.p
         return ((inv_2 * x1) % self.p, (inv_3 * y1) % self.p, 1)
 
+    def affine_batch(self, ps):
+        """Convert a list of Jacobian point tuples to affine form, using a single modular inversion.
+
+        Points at infinity are converted to None. See Montgomery's trick for simultaneous inversion."""
+        # prods[i] is the product of the Z coordinates of ps[0..i] that need an inversion
+        prods = []
+        acc = 1
+        for (_, _, z) in ps:
+            if z != 0 and z != 1:
+                acc = (acc * z) % self.p
+            prods.append(acc)
+        inv = modinv(acc, self.p)
+        ret = [None] * len(ps)
+        for i in range(len(ps) - 1, -1, -1):
+            x, y, z = ps[i]
+            if z == 0:
+                continue
+            if z == 1:
+                ret[i] = ps[i]
+                continue
+            z_inv = (inv * (prods[i - 1] if i > 0 else 1)) % self.p
+            inv = (inv * z) % self.p
+            z_inv_2 = (z_inv**2) % self.p
+            ret[i] = ((x * z_inv_2) % self.p, (y * z_inv_2 * z_inv) % self.p, 1)
+        return ret
+
     def has_even_y(self, p1):
         """Whether the point p1 has an even Y coordinate when expressed in affine coordinates."""
         return not (p1[2] == 0 or self.affine(p1)[1] & 1)
@@ -198,17 +254,107 @@ class EllipticCurve:
         z3 = (h*z1*z2) % self.p
         return (x3, y3, z3)
 
+    def set_fixed_base(self, p1, bits):
+        """Register an affine point p1 as a fixed base, for which mul() uses a table of precomputed multiples.
+
+        The table, computed on first use, covers scalars of up to `bits` bits."""
+        assert p1[2] == 1
+        self.fixed_bases[p1] = bits
+
+    def _fixed_base_table(self, p1):
+        """Return the table of p1: table[i][j - 1] is the affine point j * 2**(FIXED_BASE_WINDOW * i) * p1."""
+        table = self.fixed_bases[p1]
+        if not isinstance(table, int):
+            return table
+        num_windows = (table + FIXED_BASE_WINDOW - 1) // FIXED_BASE_WINDOW
+        points = []
+        base = p1
+        for _ in range(num_windows):
+            multiple = base
+            for _ in range((1 << FIXED_BASE_WINDOW) - 1):
+                points.append(multiple)
+                multiple = self.add_mixed(multiple, base)
+            # multiple is now 2**FIXED_BASE_WINDOW * base
+            base = self.affine(multiple)
+        points = self.affine_batch(points)
+        row = (1 << FIXED_BASE_WINDOW) - 1
+        table = [points[i * row:(i + 1) * row] for i in range(num_windows)]
+        self.fixed_bases[p1] = table
+        return table
+
+    def _mul_fixed(self, p1, n):
+        """Compute n * p1 for a fixed base p1, with one mixed addition per window of n."""
+        table = self._fixed_base_table(p1)
+        mask = (1 << FIXED_BASE_WINDOW) - 1
+        r = (0, 1, 0)
+        for window in table:
+            d = n & mask
+            if d:
+                r = self.add_mixed(r, window[d - 1])
+            n >>= FIXED_BASE_WINDOW
+        if n:
+            # Scalar larger than the table, add the high part times the next window's base
+            # (the last window's base times 2**FIXED_BASE_WINDOW).
+            r = self.add(r, self._mul_strauss([(self.affine(self.add_mixed(table[-1][-1], table[-1][0])), n)]))
+        return r
+
+    def _odd_multiples(self, p1, w):
+        """Return the Jacobian odd multiples p1, 3*p1, ..., (2**(w-1) - 1) * p1."""
+        pos = [p1]
+        if w > 2:
+            p2 = self.double(p1)
+            for _ in range((1 << (w - 2)) - 1):
+                pos.append(self.add(pos[-1], p2))
+        return pos
+
+    def _mul_strauss(self, ps):
+        """Compute a multi point multiplication with interleaved wNAF (Strauss' algorithm).
+
+        All points share a single chain of doublings, and the odd multiples
+        of all points are converted to affine form together."""
+        multiples = []
+        nafs = []
+        for (p, n) in ps:
+            w = WNAF_WINDOW if n.bit_length() > 64 else 2
+            multiples.append(self._odd_multiples(p, w))
+            nafs.append(wnaf(n, w))
+        affine = self.affine_batch([p for pos in multiples for p in pos])
+        if None not in affine:
+            # Multiples are only at infinity for points of small order, in which case
+            # the Jacobian points are used as is.
+            it = iter(affine)
+            multiples = [[next(it) for _ in pos] for pos in multiples]
+        tables = [(pos, [self.negate(p) for p in pos]) for pos in multiples]
+        r = (0, 1, 0)
+        for i in range(max(len(naf) for naf in nafs) - 1, -1, -1):
+            r = self.double(r)
+            for naf, (pos, neg) in zip(nafs, tables):
+                if i < len(naf) and naf[i]:
+                    d = naf[i]
+                    r = self.add(r, pos[d >> 1] if d > 0 else neg[-d >> 1])
+        return r
+
     def mul(self, ps):
         """Compute a (multi) point multiplication
 
         ps is a list of (Jacobian tuple, scalar) pairs.
+
+        Fixed base points (see set_fixed_base) use their precomputed table,
+        and all other points are multiplied together with Strauss' algorithm.
         """
         r = (0, 1, 0)
-        for i in range(255, -1, -1):
-            r = self.double(r)
-            for (p, n) in ps:
-                if ((n >> i) & 1):
-                    r = self.add(r, p)
+        variable = []
+        for (p, n) in ps:
+            if n < 0:
+                p, n = self.negate(p), -n
+            if n == 0 or p[2] == 0:
+                continue
+            if p in self.fixed_bases:
+                r = self.add(r, self._mul_fixed(p, n))
+            else:
+                variable.append((p, n))
+        if variable:
+            r = self.add(r, self._mul_strauss(variable))
         return r
 
 SECP256K1_FIELD_SIZE = 2**256 - 2**32 - 977
@@ -216,6 +362,116 @@ SECP256K1 = EllipticCurve(SECP256K1_FIELD_SIZE, 0, 7)
 SECP256K1_G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798, 0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8, 1)
 SECP256K1_ORDER = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
 SECP256K1_ORDER_HALF = SECP256K1_ORDER // 2
+SECP256K1.set_fixed_base(SECP256K1_G, 256)
+
+# Maximum number of serialized public keys in PUBKEY_CACHE
+PUBKEY_CACHE_SIZE = 4096
+
+def parse_pubkey(data):
+    """Parse a compressed or uncompressed public key serialization.
+
+    Returns (point, compressed), with the point in affine form, or None if
+    the serialization is invalid. Decompression takes a square root, and
+    lift_x() fails for X coordinates that are not on the curve, so no
+    separate is_x_coord() test is needed."""
+    if (len(data) == 65 and data[0] == 0x04):
+        p = (int.from_bytes(data[1:33], 'big'), int.from_bytes(data[33:65], 'big'), 1)
+        if not SECP256K1.on_curve(p):
+            return None
+        return p, False
+    if (len(data) == 33 and (data[0] == 0x02 or data[0] == 0x03)):
+        x = int.from_bytes(data[1:33], 'big')
+        if x >= SECP256K1.p:
+            return None
+        p = SECP256K1.lift_x(x)
+        if p is None:
+            return None
+        # Make the Y coordinate odd if required (lift_x always produces
+        # a point with an even Y coordinate).
+        if data[0] & 1:
+            p = SECP256K1.negate(p)
+        return p, True
+    return None
+
+class PubKeyCache():
+    """A bounded LRU cache of parse_pubkey() results, keyed by the serialized public key.
+
+    The hit and miss counters and the approximate memory use (see stats())
+    can be used to tune max_size."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.memory = 0
+
+    @staticmethod
+    def _entry_size(data, result):
+        size = sys.getsizeof(data) + sys.getsizeof(result)
+        if result is not None:
+            p = result[0]
+            size += sys.getsizeof(p) + sum(sys.getsizeof(c) for c in p)
+        return size
+
+    def get(self, data):
+        """Return parse_pubkey(data), from the cache if possible."""
+        data = bytes(data)
+        try:
+            result = self.entries[data]
+        except KeyError:
+            self.misses += 1
+            result = parse_pubkey(data)
+            self.put(data, result)
+            return result
+        self.hits += 1
+        self.entries.move_to_end(data)
+        return result
+
+    def get_many(self, datas):
+        """Return [self.get(data) for data in datas], parsing each distinct missing key once."""
+        datas = [bytes(data) for data in datas]
+        results = {}
+        for data in datas:
+            if data in results:
+                self.hits += 1
+            elif data in self.entries:
+                self.hits += 1
+                results[data] = self.entries[data]
+                self.entries.move_to_end(data)
+            else:
+                self.misses += 1
+                results[data] = parse_pubkey(data)
+                self.put(data, results[data])
+        return [results[data] for data in datas]
+
+    def put(self, data, result):
+        if data in self.entries:
+            self.memory -= self._entry_size(data, self.entries.pop(data))
+        self.entries[data] = result
+        self.memory += self._entry_size(data, result)
+        while len(self.entries) > self.max_size:
+            old_data, old_result = self.entries.popitem(last=False)
+            self.memory -= self._entry_size(old_data, old_result)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.memory = 0
+
+    def stats(self):
+        """Return the size, hit and memory counters of the cache."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'memory_bytes': self.memory,
+        }
+
+PUBKEY_CACHE = PubKeyCache(PUBKEY_CACHE_SIZE)
 
 class ECPubKey():
     """A secp256k1 public key"""
@@ -225,28 +481,15 @@ class ECPubKey():
         self.valid = False
 
     def set(self, data):
-        """Construct a public key from a serialization in compressed or uncompressed format"""
-        if (len(data) == 65 and data[0] == 0x04):
-            p = (int.from_bytes(data[1:33], 'big'), int.from_bytes(data[33:65], 'big'), 1)
-            self.valid = SECP256K1.on_curve(p)
-            if self.valid:
-                self.p = p
-                self.compressed = False
-        elif (len(data) == 33 and (data[0] == 0x02 or data[0] == 0x03)):
-            x = int.from_bytes(data[1:33], 'big')
-            if SECP256K1.is_x_coord(x):
-                p = SECP256K1.lift_x(x)
-                # Make the Y coordinate odd if required (lift_x always produces
-                # a point with an even Y coordinate).
-                if data[0] & 1:
-                    p = SECP256K1.negate(p)
-                self.p = p
-                self.valid = True
-                self.compressed = True
-            else:
-                self.valid = False
-        else:
-            self.valid = False
+        """Construct a public key from a serialization in compressed or uncompressed format
+
+        Parsed keys are cached in PUBKEY_CACHE."""
+        self._set_parsed(PUBKEY_CACHE.get(data))
+
+    def _set_parsed(self, result):
+        self.valid = result is not None
+        if self.valid:
+            self.p, self.compressed = result
 
     @property
     def is_compressed(self):
@@ -322,6 +565,19 @@ class ECPubKey():
             return False
         return True
 
+def parse_pubkeys(datas):
+    """Construct a list of ECPubKeys from a list of serializations, as with ECPubKey.set().
+
+    Each distinct serialization that is not in PUBKEY_CACHE is parsed once.
+    The points are affine, so that signature verifications do not need
+    field inversions to convert them."""
+    pubkeys = []
+    for result in PUBKEY_CACHE.get_many(datas):
+        pubkey = ECPubKey()
+        pubkey._set_parsed(result)
+        pubkeys.append(pubkey)
+    return pubkeys
+
 def generate_privkey():
     """Generate a valid random 32-byte private key."""
     return random.randrange(1, SECP256K1_ORDER).to_bytes(32, 'big')
@@ -441,30 +697,40 @@ def tweak_add_pubkey(key, tweak):
         return None
     return (Q[0].to_bytes(32, 'big'), not SECP256K1.has_even_y(Q))
 
-def verify_schnorr(key, sig, msg):
-    """Verify a Schnorr signature (see BIP 340).
+def parse_schnorr(key, sig, msg):
+    """Parse a Schnorr signature for verification (see BIP 340).
 
-    - key is a 32-byte xonly pubkey (computed using compute_xonly_pubkey).
-    - sig is a 64-byte Schnorr signature
-    - msg is a 32-byte message
-    """
+    Returns (P, r, s, e), or None if the key or signature is invalid."""
     assert len(key) == 32
     assert len(msg) == 32
     assert len(sig) == 64
 
     x_coord = int.from_bytes(key, 'big')
     if x_coord == 0 or x_coord >= SECP256K1_FIELD_SIZE:
-        return False
+        return None
     P = SECP256K1.lift_x(x_coord)
     if P is None:
-        return False
+        return None
     r = int.from_bytes(sig[0:32], 'big')
     if r >= SECP256K1_FIELD_SIZE:
-        return False
+        return None
     s = int.from_bytes(sig[32:64], 'big')
     if s >= SECP256K1_ORDER:
-        return False
+        return None
     e = int.from_bytes(TaggedHash("BIP0340/challenge", sig[0:32] + key + msg), 'big') % SECP256K1_ORDER
+    return (P, r, s, e)
+
+def verify_schnorr(key, sig, msg):
+    """Verify a Schnorr signature (see BIP 340).
+
+    - key is a 32-byte xonly pubkey (computed using compute_xonly_pubkey).
+    - sig is a 64-byte Schnorr signature
+    - msg is a 32-byte message
+    """
+    parsed = parse_schnorr(key, sig, msg)
+    if parsed is None:
+        return False
+    P, r, s, e = parsed
     R = SECP256K1.mul([(SECP256K1_G, s), (P, SECP256K1_ORDER - e)])
     if not SECP256K1.has_even_y(R):
         return False
@@ -472,6 +738,54 @@ def verify_schnorr(key, sig, msg):
         return False
     return True
 
+def _schnorr_batch_equation(batch):
+    """Check the batch verification equation for a list of (P, R, s, e) with random weights a_i (a_0 = 1):
+
+    (sum a_i*s_i) * G - sum a_i*R_i - sum (a_i*e_i) * P_i == infinity
+
+    The scalars of equal public keys are combined, so that each is multiplied only once."""
+    s_sum = 0
+    scalars = {}
+    for i, (P, R, s, e) in enumerate(batch):
+        a = 1 if i == 0 else random.randrange(1, SECP256K1_ORDER)
+        s_sum += a * s
+        scalars[R] = scalars.get(R, 0) - a
+        scalars[P] = scalars.get(P, 0) - a * e
+    ps = [(p, n % SECP256K1_ORDER) for p, n in scalars.items()]
+    ps.append((SECP256K1_G, s_sum % SECP256K1_ORDER))
+    return SECP256K1.mul(ps)[2] == 0
+
+def verify_schnorr_batch(sigs):
+    """Verify a list of (key, sig, msg) Schnorr signatures (see verify_schnorr) together.
+
+    All valid signatures are checked with a single multi point
+    multiplication, using a random linear combination of their verification
+    equations (see BIP 340). If that fails, the batch is bisected to find
+    the invalid signatures. Returns a list with the result for each signature."""
+    results = [False] * len(sigs)
+    batch = []
+    for i, (key, sig, msg) in enumerate(sigs):
+        parsed = parse_schnorr(key, sig, msg)
+        if parsed is None:
+            continue
+        P, r, s, e = parsed
+        R = SECP256K1.lift_x(r)
+        if R is None:
+            continue
+        batch.append((i, (P, R, s, e)))
+
+    def bisect(entries):
+        if _schnorr_batch_equation([entry for _, entry in entries]):
+            for i, _ in entries:
+                results[i] = True
+        elif len(entries) > 1:
+            bisect(entries[:len(entries) // 2])
+            bisect(entries[len(entries) // 2:])
+
+    if batch:
+        bisect(batch)
+    return results
+
 def sign_schnorr(key, msg, aux=None, flip_p=False, flip_r=False):
     """Create a Schnorr signature (see BIP 340)."""
 
@@ -497,6 +811,32 @@ def sign_schnorr(key, msg, aux=None, flip_p=False, flip_r=False):
     return R[0].to_bytes(32, 'big') + ((k + e * sec) % SECP256K1_ORDER).to_bytes(32, 'big')
 
 class TestFrameworkKey(unittest.TestCase):
+    def test_mul(self):
+        """Test the point multiplication against plain double-and-add."""
+        def mul_reference(ps):
+            r = (0, 1, 0)
+            for i in range(max(n.bit_length() for _, n in ps) - 1, -1, -1):
+                r = SECP256K1.double(r)
+                for (p, n) in ps:
+                    if ((n >> i) & 1):
+                        r = SECP256K1.add(r, p)
+            return r
+
+        points = [SECP256K1_G, SECP256K1.lift_x(1), SECP256K1.double(SECP256K1_G)]
+        scalars = [1, 2, 3, 2**64, SECP256K1_ORDER - 1, SECP256K1_ORDER, 2**256 - 1, 2**300 + 12345] + [random.randrange(1, SECP256K1_ORDER) for _ in range(5)]
+        for n in scalars:
+            for p in points:
+                self.assertEqual(SECP256K1.affine(SECP256K1.mul([(p, n)])), SECP256K1.affine(mul_reference([(p, n)])))
+            ps = [(p, random.choice(scalars)) for p in points]
+            self.assertEqual(SECP256K1.affine(SECP256K1.mul(ps)), SECP256K1.affine(mul_reference(ps)))
+        self.assertEqual(SECP256K1.mul([(SECP256K1_G, 0), (points[1], 0)])[2], 0)
+
+    def test_affine_batch(self):
+        points = [SECP256K1.mul([(SECP256K1_G, random.randrange(1, SECP256K1_ORDER))]) for _ in range(5)]
+        points += [(0, 1, 0), SECP256K1_G]
+        random.shuffle(points)
+        self.assertEqual(SECP256K1.affine_batch(points), [SECP256K1.affine(p) for p in points])
+
     def test_schnorr(self):
         """Test the Python Schnorr implementation."""
         byte_arrays = [generate_privkey() for _ in range(3)] + [v.to_bytes(32, 'big') for v in [0, SECP256K1_ORDER - 1, SECP256K1_ORDER, 2**256 - 1]]
@@ -519,6 +859,7 @@ class TestFrameworkKey(unittest.TestCase):
     def test_schnorr_testvectors(self):
         """Implement the BIP340 test vectors (read from bip340_test_vectors.csv)."""
         num_tests = 0
+        batch = []
         vectors_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'bip340_test_vectors.csv')
         with open(vectors_file, newline='', encoding='utf8') as csvfile:
             reader = csv.reader(csvfile)
@@ -545,5 +886,69 @@ class TestFrameworkKey(unittest.TestCase):
                     self.assertEqual(result, result_actual, "BIP340 test vector %i (%s): verification failed" % (i, comment))
                 else:
                     self.assertEqual(result, result_actual, "BIP340 test vector %i (%s): verification succeeded unexpectedly" % (i, comment))
+                batch.append(((pubkey, sig, msg), result))
                 num_tests += 1
         self.assertTrue(num_tests >= 15) # expect at least 15 test vectors
+        self.assertEqual(verify_schnorr_batch([sig for sig, _ in batch]), [result for _, result in batch])
+
+    def test_schnorr_batch(self):
+        """Test batch verification of Schnorr signatures against verify_schnorr."""
+        seckeys = [generate_privkey() for _ in range(3)]
+        sigs = []
+        for i in range(20):
+            seckey = seckeys[i % len(seckeys)]
+            msg = random.randrange(2**256).to_bytes(32, 'big')
+            sigs.append((compute_xonly_pubkey(seckey)[0], sign_schnorr(seckey, msg), msg))
+        self.assertEqual(verify_schnorr_batch([]), [])
+        self.assertEqual(verify_schnorr_batch(sigs), [True] * len(sigs))
+        # Corrupt the s value, the R value, the message and the key of some signatures
+        bad = {3: 1, 7: 2, 8: 3, 19: 4}
+        corrupted = list(sigs)
+        for i, kind in bad.items():
+            key, sig, msg = sigs[i]
+            if kind == 1:
+                sig = sig[:32] + ((int.from_bytes(sig[32:], 'big') + 1) % SECP256K1_ORDER).to_bytes(32, 'big')
+            elif kind == 2:
+                sig = sigs[i - 1][1][:32] + sig[32:]
+            elif kind == 3:
+                msg = bytes(32)
+            else:
+                key = sigs[i - 1][0] if sigs[i - 1][0] != key else sigs[i - 2][0]
+            corrupted[i] = (key, sig, msg)
+        expected = [verify_schnorr(*sig) for sig in corrupted]
+        self.assertEqual(expected, [i not in bad for i in range(len(sigs))])
+        self.assertEqual(verify_schnorr_batch(corrupted), expected)
+
+    def test_pubkey_cache(self):
+        """Test parsing public keys through a PubKeyCache and parse_pubkeys."""
+        keys = []
+        for compressed in [True, False]:
+            for _ in range(3):
+                key = ECKey()
+                key.generate(compressed)
+                keys.append(key.get_pubkey().get_bytes())
+        # Invalid keys: X coordinate not on the curve, X coordinate not below the field size, bad prefix
+        x = next(x for x in range(1, 100) if not SECP256K1.is_x_coord(x))
+        invalid = [bytes([2]) + x.to_bytes(32, 'big'), bytes([3]) + (SECP256K1_FIELD_SIZE + 1).to_bytes(32, 'big'), bytes([5]) + keys[0][1:]]
+        cache = PubKeyCache(4)
+        for data in keys:
+            p, compressed = cache.get(data)
+            self.assertEqual(compressed, len(data) == 33)
+            pubkey = ECPubKey()
+            pubkey.set(data)
+            self.assertEqual(pubkey.get_bytes(), data)
+        for data in invalid:
+            self.assertIsNone(cache.get(data))
+        stats = cache.stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['misses']), (4, 0, 9))
+        self.assertGreater(stats['memory_bytes'], 0)
+        # The 4 most recently used keys are kept
+        self.assertEqual(cache.get_many([invalid[0], keys[5], invalid[0]]), [None, cache.entries[keys[5]], None])
+        self.assertEqual(cache.stats()['hits'], 3)
+        cache.get(keys[0])
+        self.assertEqual(list(cache.entries), [invalid[2], invalid[0], keys[5], keys[0]])
+        cache.clear()
+        self.assertEqual(cache.stats(), {'size': 0, 'max_size': 4, 'hits': 0, 'misses': 0, 'hit_rate': 0.0, 'memory_bytes': 0})
+        pubkeys = parse_pubkeys(keys + invalid)
+        self.assertEqual([pubkey.is_valid for pubkey in pubkeys], [True] * len(keys) + [False] * len(invalid))
+        self.assertEqual([pubkey.get_bytes() for pubkey in pubkeys[:len(keys)]], keys)
@@ -27,8 +27,9 @@ import random
 import socket
 import struct
 import time
+import unittest
 
-from test_framework.siphash import siphash256
+from test_framework.siphash import siphash256, siphash256_many
 from test_framework.util import hex_str_to_bytes, assert_equal
 
 MAX_LOCATOR_SZ = 101
@@ -830,18 +831,25 @@ def calculate_shortid(k0, k1, tx_hash):
     expected_shortid &= 0x0000ffffffffffff
     return expected_shortid
 
+# Calculate the shortids of a list of transaction hashes at once
+def calculate_shortids(k0, k1, tx_hashes):
+    return [h & 0x0000ffffffffffff for h in siphash256_many(k0, k1, tx_hashes)]
+
 
 # This version gets rid of the array lengths, and reinterprets the differential
 # encoding into indices that can be used for lookup.
 class HeaderAndShortIDs:
     __slots__ = ("header", "nonce", "prefilled_txn", "shortids", "use_witness")
 
-    def __init__(self, p2pheaders_and_shortids = None):
+    # The wire format does not tell whether the shortids are computed from
+    # the txids (version 1) or the wtxids (version 2), so use_witness must be
+    # set to the negotiated version for blocks received from a node.
+    def __init__(self, p2pheaders_and_shortids = None, use_witness = False):
         self.header = CBlockHeader()
         self.nonce = 0
         self.shortids = []
         self.prefilled_txn = []
-        self.use_witness = False
+        self.use_witness = use_witness
 
         if p2pheaders_and_shortids is not None:
             self.header = p2pheaders_and_shortids.header
@@ -887,12 +895,53 @@ class HeaderAndShortIDs:
         self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
+        prefilled = set(prefill_list)
+        tx_hashes = []
         for i in range(len(block.vtx)):
-            if i not in prefill_list:
+            if i not in prefilled:
                 tx_hash = block.vtx[i].sha256
                 if use_witness:
                     tx_hash = block.vtx[i].calc_sha256(with_witness=True)
-                self.shortids.append(calculate_shortid(k0, k1, tx_hash))
+                tx_hashes.append(tx_hash)
+        self.shortids = calculate_shortids(k0, k1, tx_hashes)
+
+    def get_shortid_index(self, txs):
+        """Return a dict from shortid to transaction for the transactions txs (e.g. a mempool).
+
+        Shortids that several of the transactions have map to None, as they
+        cannot be used to reconstruct a block."""
+        [k0, k1] = self.get_siphash_keys()
+        tx_hashes = []
+        for tx in txs:
+            if self.use_witness:
+                tx_hashes.append(tx.calc_sha256(with_witness=True))
+            else:
+                if tx.sha256 is None:
+                    tx.calc_sha256()
+                tx_hashes.append(tx.sha256)
+        index = {}
+        for shortid, tx in zip(calculate_shortids(k0, k1, tx_hashes), txs):
+            index[shortid] = None if shortid in index else tx
+        return index
+
+    def reconstruct(self, shortid_index):
+        """Fill in the transactions of the block from a shortid index (see get_shortid_index).
+
+        Returns the block and the list of indexes of the transactions that
+        are missing, as for a getblocktxn request. Missing transactions are
+        None in block.vtx."""
+        block = CBlock(self.header)
+        block.vtx = [None] * (len(self.prefilled_txn) + len(self.shortids))
+        for prefilled in self.prefilled_txn:
+            block.vtx[prefilled.index] = prefilled.tx
+        missing = []
+        shortids = iter(self.shortids)
+        for i in range(len(block.vtx)):
+            if block.vtx[i] is None:
+                block.vtx[i] = shortid_index.get(next(shortids))
+                if block.vtx[i] is None:
+                    missing.append(i)
+        return block, missing
 
     def __repr__(self):
         return "HeaderAndShortIDs(header=%s, nonce=%d, shortids=%s, prefilledtxn=%s" % (repr(self.header), self.nonce, repr(self.shortids), repr(self.prefilled_txn))
@@ -1264,7 +1313,7 @@ class msg_block:
 # for cases where a user needs tighter control over what is sent over the wire
 # note that the user must supply the name of the msgtype, and the data
 class msg_generic:
-    __slots__ = ("data")
+    __slots__ = ("msgtype", "data")
 
     def __init__(self, msgtype, data=None):
         self.msgtype = msgtype
@@ -1277,6 +1326,22 @@ class msg_generic:
         return "msg_generic()"
 
 
+# for received messages whose payload was not deserialized (see
+# P2PConnection.decode_msgtypes). data is a read-only view of the raw payload.
+class msg_undecoded:
+    __slots__ = ("msgtype", "data")
+
+    def __init__(self, msgtype, data=b""):
+        self.msgtype = msgtype
+        self.data = data
+
+    def serialize(self):
+        return bytes(self.data)
+
+    def __repr__(self):
+        return "msg_undecoded(msgtype=%s, len=%i)" % (self.msgtype.decode('ascii'), len(self.data))
+
+
 class msg_no_witness_block(msg_block):
     __slots__ = ()
     def serialize(self):
@@ -1781,3 +1846,68 @@ class msg_cfcheckpt:
     def __repr__(self):
         return "msg_cfcheckpt(filter_type={:#x}, stop_hash={:x})".format(
             self.filter_type, self.stop_hash)
+
+
+class TestFrameworkMessages(unittest.TestCase):
+    def test_compact_block_reconstruction(self):
+        coinbase = CTransaction()
+        coinbase.vin = [CTxIn(COutPoint(0, 0xffffffff), b"\x01\x01")]
+        coinbase.vout = [CTxOut(50 * COIN, b"\x51")]
+        txs = []
+        for i in range(6):
+            tx = CTransaction()
+            tx.vin = [CTxIn(COutPoint(i + 1, 0))]
+            tx.vout = [CTxOut(COIN, b"\x51")]
+            if i % 2:
+                # Half of the txs have a witness, so that their wtxid is not their txid
+                tx.wit.vtxinwit = [CTxInWitness()]
+                tx.wit.vtxinwit[0].scriptWitness.stack = [bytes([i])]
+            tx.rehash()
+            txs.append(tx)
+        block = CBlock()
+        block.hashPrevBlock = 0x1234
+        block.nTime = 1600000000
+        block.nBits = 0x207fffff
+        block.vtx = [coinbase] + txs
+        block.hashMerkleRoot = block.calc_merkle_root()
+        block.rehash()
+        witness_txs = [tx for tx in txs if not tx.wit.is_null()]
+
+        for use_witness in [False, True]:
+            cmpct = HeaderAndShortIDs()
+            cmpct.initialize_from_block(block, nonce=42, prefill_list=[0, 3], use_witness=use_witness)
+            k0, k1 = cmpct.get_siphash_keys()
+            not_prefilled = [tx for i, tx in enumerate(block.vtx) if i not in [0, 3]]
+            tx_hashes = [tx.calc_sha256(with_witness=True) if use_witness else tx.sha256 for tx in not_prefilled]
+            self.assertEqual(cmpct.shortids, calculate_shortids(k0, k1, tx_hashes))
+
+            # Round trip through the wire format
+            p2p = P2PHeaderAndShortIDs()
+            p2p.deserialize(BytesIO(cmpct.to_p2p().serialize()))
+            received = HeaderAndShortIDs(p2p, use_witness=use_witness)
+            self.assertEqual(received.shortids, cmpct.shortids)
+            self.assertEqual([(p.index, p.tx.serialize()) for p in received.prefilled_txn], [(0, coinbase.serialize()), (3, block.vtx[3].serialize())])
+
+            # All txs are in the "mempool", in another order
+            mempool = list(reversed(not_prefilled))
+            rebuilt, missing = received.reconstruct(received.get_shortid_index(mempool))
+            self.assertEqual(missing, [])
+            self.assertEqual(rebuilt.serialize(), block.serialize())
+            rebuilt.rehash()
+            self.assertEqual(rebuilt.sha256, block.sha256)
+            self.assertEqual(rebuilt.calc_merkle_root(), block.hashMerkleRoot)
+
+            # Some txs are missing
+            mempool = [tx for tx in not_prefilled if tx not in [block.vtx[2], block.vtx[5]]]
+            rebuilt, missing = received.reconstruct(received.get_shortid_index(mempool))
+            self.assertEqual(missing, [2, 5])
+            self.assertEqual([i for i, tx in enumerate(rebuilt.vtx) if tx is None], [2, 5])
+
+        # Shortids of a version 2 compact block taken as version 1 shortids
+        # do not match the txs with a witness
+        received = HeaderAndShortIDs(p2p)
+        _, missing = received.reconstruct(received.get_shortid_index(not_prefilled))
+        self.assertEqual(missing, [block.vtx.index(tx) for tx in witness_txs if tx is not block.vtx[3]])
+
+        # Txs with the same shortid cannot be used
+        self.assertEqual(list(received.get_shortid_index([txs[0], txs[0]]).values()), [None])
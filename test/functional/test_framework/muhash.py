@@ -3,19 +3,30 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Native Python MuHash3072 implementation."""
 
+import concurrent.futures
 import hashlib
 import unittest
 
 from .util import modinv
 
+# Number of elements hashed together by a chacha20_32_to_384_many call in MuHash3072.insert_many
+CHACHA20_BATCH_SIZE = 1024
+# Every 32-bit ChaCha20 state word of a batch is kept in a 64-bit lane of one
+# integer. The upper half of each lane absorbs the carries of additions and the
+# bits that rotations shift out of the word or in from the next lane, and is
+# masked away after each step.
+LANE_BYTES = 8
+
 def rot32(v, bits):
     """Rotate the 32-bit value v left by bits bits."""
     bits %= 32  # Make sure the term below does not throw an exception
     return ((v << bits) & 0xffffffff) | (v >> (32 - bits))
 
-def chacha20_doubleround(s):
+def chacha20_doubleround(s, mask=0xffffffff):
     """Apply a ChaCha20 double round to 16-element state array s.
 
+    With a mask of 0xffffffff in several 64-bit lanes, every element of s holds
+    the corresponding word of several states (see chacha20_32_to_384_many).
     See https://cr.yp.to/chacha/chacha-20080128.pdf and https://tools.ietf.org/html/rfc8439
     """
     QUARTER_ROUNDS = [(0, 4, 8, 12),
@@ -27,42 +38,111 @@ def chacha20_doubleround(s):
                       (2, 7, 8, 13),
                       (3, 4, 9, 14)]
 
+    # The rotations are inlined, as rot32 does not support lanes.
     for a, b, c, d in QUARTER_ROUNDS:
-        s[a] = (s[a] + s[b]) & 0xffffffff
-        s[d] = rot32(s[d] ^ s[a], 16)
-        s[c] = (s[c] + s[d]) & 0xffffffff
-        s[b] = rot32(s[b] ^ s[c], 12)
-        s[a] = (s[a] + s[b]) & 0xffffffff
-        s[d] = rot32(s[d] ^ s[a], 8)
-        s[c] = (s[c] + s[d]) & 0xffffffff
-        s[b] = rot32(s[b] ^ s[c], 7)
-
-def chacha20_32_to_384(key32):
-    """Specialized ChaCha20 implementation with 32-byte key, 0 IV, 384-byte output."""
+        s[a] = (s[a] + s[b]) & mask
+        v = s[d] ^ s[a]
+        s[d] = ((v << 16) | (v >> 16)) & mask
+        s[c] = (s[c] + s[d]) & mask
+        v = s[b] ^ s[c]
+        s[b] = ((v << 12) | (v >> 20)) & mask
+        s[a] = (s[a] + s[b]) & mask
+        v = s[d] ^ s[a]
+        s[d] = ((v << 8) | (v >> 24)) & mask
+        s[c] = (s[c] + s[d]) & mask
+        v = s[b] ^ s[c]
+        s[b] = ((v << 7) | (v >> 25)) & mask
+
+def chacha20_32_to_384_many(keys):
+    """Specialized ChaCha20 implementation with 32-byte keys, 0 IV, 384-byte outputs.
+
+    Computes the output for all keys at once: every state word holds the
+    corresponding word of all ChaCha20 states, one per 64-bit lane, so
+    that each integer operation applies to all keys.
+    """
     # See RFC 8439 section 2.3 for chacha20 parameters
     CONSTANTS = [0x61707865, 0x3320646e, 0x79622d32, 0x6b206574]
 
-    key_bytes = [0]*8
+    n = len(keys)
+    if n == 0:
+        return []
+    # Multiplying a 32-bit value by ones repeats it in every lane
+    ones = int.from_bytes((b'\x01' + bytes(LANE_BYTES - 1)) * n, 'little')
+    mask = 0xffffffff * ones
+
+    key_bytes = b"".join(bytes(key32) for key32 in keys)
+    assert len(key_bytes) == 32 * n
+    key_words = []
     for i in range(8):
-        key_bytes[i] = int.from_bytes(key32[(4 * i):(4 * (i+1))], 'little')
+        lanes = bytearray(LANE_BYTES * n)
+        for j in range(4):
+            lanes[j::LANE_BYTES] = key_bytes[4 * i + j::32]
+        key_words.append(int.from_bytes(lanes, 'little'))
 
     INITIALIZATION_VECTOR = [0] * 4
-    init = CONSTANTS + key_bytes + INITIALIZATION_VECTOR
-    out = bytearray()
+    init = [c * ones for c in CONSTANTS] + key_words + INITIALIZATION_VECTOR
+    out = bytearray(384 * n)
     for counter in range(6):
-        init[12] = counter
+        init[12] = counter * ones
         s = init.copy()
         for _ in range(10):
-            chacha20_doubleround(s)
+            chacha20_doubleround(s, mask)
         for i in range(16):
-            out.extend(((s[i] + init[i]) & 0xffffffff).to_bytes(4, 'little'))
-    return bytes(out)
+            lanes = ((s[i] + init[i]) & mask).to_bytes(LANE_BYTES * n, 'little')
+            pos = 64 * counter + 4 * i
+            for j in range(4):
+                out[pos + j::384] = lanes[j::LANE_BYTES]
+    return [bytes(out[384 * k:384 * (k + 1)]) for k in range(n)]
+
+def chacha20_32_to_384(key32):
+    """Specialized ChaCha20 implementation with 32-byte key, 0 IV, 384-byte output."""
+    return chacha20_32_to_384_many([key32])[0]
 
 def data_to_num3072(data):
     """Hash a 32-byte array data to a 3072-bit number using 6 Chacha20 operations."""
     bytes384 = chacha20_32_to_384(data)
     return int.from_bytes(bytes384, 'little')
 
+def reduce3072(x):
+    """Reduce x modulo MuHash3072.MODULUS.
+
+    As the modulus is 2**3072 - c for a small c, this only needs shifts,
+    additions and multiplications by c."""
+    c = 2**3072 - MuHash3072.MODULUS
+    while x >> 3072:
+        x = (x & (2**3072 - 1)) + (x >> 3072) * c
+    return x - MuHash3072.MODULUS if x >= MuHash3072.MODULUS else x
+
+def num3072_product(nums):
+    """Multiply a list of numbers modulo MuHash3072.MODULUS through a balanced product tree."""
+    nums = list(nums)
+    if not nums:
+        return 1
+    while len(nums) > 1:
+        products = [reduce3072(nums[i] * nums[i + 1]) for i in range(0, len(nums) - 1, 2)]
+        if len(nums) % 2:
+            products.append(nums[-1])
+        nums = products
+    return reduce3072(nums[0])
+
+def data_product(items):
+    """Return the product modulo MuHash3072.MODULUS of the MuHash3072 elements of the byte arrays items."""
+    partials = []
+    for i in range(0, len(items), CHACHA20_BATCH_SIZE):
+        keys = [hashlib.sha256(data).digest() for data in items[i:i + CHACHA20_BATCH_SIZE]]
+        partials.append(num3072_product(int.from_bytes(bytes384, 'little') for bytes384 in chacha20_32_to_384_many(keys)))
+    return num3072_product(partials)
+
+def data_product_sharded(items, processes):
+    """Compute data_product(items), with the items split into one shard per worker process."""
+    items = list(items)
+    if processes <= 1 or len(items) < 2 * CHACHA20_BATCH_SIZE:
+        return data_product(items)
+    shard_size = -(-len(items) // processes)
+    shards = [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        return num3072_product(executor.map(data_product, shards))
+
 class MuHash3072:
     """Class representing the MuHash3072 computation of a set.
 
@@ -86,6 +166,17 @@ class MuHash3072:
         data_hash = hashlib.sha256(data).digest()
         self.denominator = (self.denominator * data_to_num3072(data_hash)) % self.MODULUS
 
+    def insert_many(self, items, *, processes=1):
+        """Insert an iterable of byte arrays in the set.
+
+        This is much faster than calling insert for each of them. With
+        processes > 1, large sets are hashed by that many worker processes."""
+        self.numerator = reduce3072(self.numerator * data_product_sharded(items, processes))
+
+    def remove_many(self, items, *, processes=1):
+        """Remove an iterable of byte arrays from the set (see insert_many)."""
+        self.denominator = reduce3072(self.denominator * data_product_sharded(items, processes))
+
     def digest(self):
         """Extract the final hash. Does not modify this object."""
         val = (self.numerator * modinv(self.denominator, self.MODULUS)) % self.MODULUS
@@ -102,6 +193,37 @@ class TestFrameworkMuhash(unittest.TestCase):
         # This mirrors the result in the C++ MuHash3072 unit test
         self.assertEqual(finalized[::-1].hex(), "10d312b100cbd32ada024a6646e40d3482fcff103668d2625f10002a607d5863")
 
+    def test_muhash_many(self):
+        items = [bytes([i]) * (i % 40) for i in range(100)]
+        expected = MuHash3072()
+        for data in items[:60]:
+            expected.insert(data)
+        for data in items[60:]:
+            expected.remove(data)
+        muhash = MuHash3072()
+        muhash.insert_many(items[:60])
+        muhash.remove_many(iter(items[60:]))
+        self.assertEqual(muhash.digest(), expected.digest())
+        muhash.insert_many([])
+        self.assertEqual(muhash.digest(), expected.digest())
+
+    def test_muhash_many_sharded(self):
+        items = [i.to_bytes(4, 'little') for i in range(2 * CHACHA20_BATCH_SIZE + 1)]
+        expected = MuHash3072()
+        expected.insert_many(items)
+        muhash = MuHash3072()
+        muhash.insert_many(items, processes=2)
+        self.assertEqual(muhash.digest(), expected.digest())
+
+    def test_num3072_product(self):
+        nums = [MuHash3072.MODULUS - 1, 2**3072 - 1, 12345] + [data_to_num3072(bytes([i]) * 32) for i in range(10)]
+        expected = 1
+        for num in nums:
+            expected = expected * num % MuHash3072.MODULUS
+        self.assertEqual(num3072_product(nums), expected)
+        self.assertEqual(num3072_product([]), 1)
+        self.assertEqual(reduce3072(MuHash3072.MODULUS), 0)
+
     def test_chacha20(self):
         def chacha_check(key, result):
             self.assertEqual(chacha20_32_to_384(key)[:64].hex(), result)
@@ -110,3 +232,6 @@ class TestFrameworkMuhash(unittest.TestCase):
         # Since the nonce is hardcoded to 0 in our function we only use those vectors.
         chacha_check([0]*32, "76b8e0ada0f13d90405d6ae55386bd28bdd219b8a08ded1aa836efcc8b770dc7da41597c5157488d7724e03fb8d84a376a43b8f41518a11cc387b669b2ee6586")
         chacha_check([0]*31 + [1], "4540f05a9f1fb296d7736e7b208e3c96eb4fe1834688d2604f450952ed432d41bbe2a0b6ea7566d2a5d1e7e20d42af2c53d792b1c43fea817e9ad275ae546963")
+        # The batched computation matches the single key one
+        keys = [bytes([i]) * 32 for i in range(5)]
+        self.assertEqual(chacha20_32_to_384_many(keys), [chacha20_32_to_384(key) for key in keys])
@@ -18,7 +18,9 @@ P2PInterface: A high-level interface object for communicating to a node over P2P
 P2PDataStore: A p2p interface class that keeps a store of transactions and blocks
               and can respond correctly to getdata and getheaders messages
 P2PTxInvStore: A p2p interface class that inherits from P2PDataStore, and keeps
-              a count of how many times each txid has been announced."""
+              a count of how many times each txid has been announced.
+P2PSwarm: A group of P2PInterface connections to the same node that are
+          handshaked, messaged and synced together."""
 
 import asyncio
 from collections import defaultdict
@@ -44,6 +46,7 @@ from test_framework.messages import (
     msg_filteradd,
     msg_filterclear,
     msg_filterload,
+    msg_generic,
     msg_getaddr,
     msg_getblocks,
     msg_getblocktxn,
@@ -62,12 +65,14 @@ from test_framework.messages import (
     msg_tx,
     MSG_TX,
     MSG_TYPE_MASK,
+    msg_undecoded,
     msg_verack,
     msg_version,
     MSG_WTX,
     msg_wtxidrelay,
     NODE_NETWORK,
     NODE_WITNESS,
+    ser_compact_size,
     sha256,
 )
 from test_framework.util import (
@@ -124,6 +129,10 @@ MESSAGEMAP = {
     b"wtxidrelay": msg_wtxidrelay,
 }
 
+# Message types that P2PInterface always deserializes, regardless of its
+# decode_msgtypes setting, because the handshake and ping helpers depend on them
+ALWAYS_DECODED_MSGTYPES = frozenset([b"ping", b"pong", b"verack", b"version"])
+
 MAGIC_BYTES = {
     "mainnet": b"\xf9\xbe\xb4\xd9",   # mainnet
     "testnet3": b"\x0b\x11\x09\x07",  # testnet3
@@ -149,6 +158,12 @@ class P2PConnection(asyncio.Protocol):
         # The underlying transport of the connection.
         # Should only call methods on this from the NetworkThread, c.f. call_soon_threadsafe
         self._transport = None
+        # Set of message types (as bytes) to deserialize on receipt. None means
+        # all message types are deserialized. Any other message type is passed
+        # to on_message() as a msg_undecoded payload view, or silently dropped
+        # if drop_undecoded is set.
+        self.decode_msgtypes = None
+        self.drop_undecoded = False
 
     @property
     def is_connected(self):
@@ -193,6 +208,7 @@ class P2PConnection(asyncio.Protocol):
             self.send_message(self.on_connection_send_msg)
             self.on_connection_send_msg = None  # Never used again
         self.on_open()
+        self._notify_waiters()
 
     def connection_lost(self, exc):
         """asyncio callback when a connection is closed."""
@@ -203,6 +219,12 @@ class P2PConnection(asyncio.Protocol):
         self._transport = None
         self.recvbuf = b""
         self.on_close()
+        self._notify_waiters()
+
+    def _notify_waiters(self):
+        """Wake up threads waiting on p2p_lock to re-evaluate their predicates."""
+        with p2p_lock:
+            p2p_lock.notify_all()
 
     # Socket read methods
 
@@ -231,17 +253,22 @@ class P2PConnection(asyncio.Protocol):
                 checksum = self.recvbuf[4+12+4:4+12+4+4]
                 if len(self.recvbuf) < 4 + 12 + 4 + 4 + msglen:
                     return
-                msg = self.recvbuf[4+12+4+4:4+12+4+4+msglen]
+                msg = memoryview(self.recvbuf)[4+12+4+4:4+12+4+4+msglen]
                 th = sha256(msg)
                 h = sha256(th)
                 if checksum != h[:4]:
                     raise ValueError("got bad checksum " + repr(self.recvbuf))
                 self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
                 if msgtype not in MESSAGEMAP:
-                    raise ValueError("Received unknown msgtype from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, msgtype, repr(msg)))
-                f = BytesIO(msg)
-                t = MESSAGEMAP[msgtype]()
-                t.deserialize(f)
+                    raise ValueError("Received unknown msgtype from %s:%d: '%s' %s" % (self.dstaddr, self.dstport, msgtype, repr(bytes(msg))))
+                if self.decode_msgtypes is None or msgtype in self.decode_msgtypes:
+                    f = BytesIO(msg)
+                    t = MESSAGEMAP[msgtype]()
+                    t.deserialize(f)
+                elif self.drop_undecoded:
+                    continue
+                else:
+                    t = msg_undecoded(msgtype, msg)
                 self._log_message("receive", t)
                 self.on_message(t)
         except Exception as e:
@@ -311,10 +338,21 @@ class P2PInterface(P2PConnection):
     node over P2P.
 
     Individual testcases should subclass this and override the on_* methods
-    if they want to alter message handling behaviour."""
-    def __init__(self, support_addrv2=False, wtxidrelay=True):
+    if they want to alter message handling behaviour.
+
+    If decode_msgtypes is given (e.g. ["inv", "headers"]), only those message
+    types (plus ALWAYS_DECODED_MSGTYPES) are deserialized. All other messages
+    are counted and stored in last_message as msg_undecoded objects and passed
+    to on_undecoded() instead of their on_* callback, or dropped entirely if
+    drop_undecoded is set."""
+    def __init__(self, support_addrv2=False, wtxidrelay=True, decode_msgtypes=None, drop_undecoded=False):
         super().__init__()
 
+        if decode_msgtypes is not None:
+            self.decode_msgtypes = ALWAYS_DECODED_MSGTYPES.union(
+                msgtype.encode('ascii') if isinstance(msgtype, str) else msgtype for msgtype in decode_msgtypes)
+        self.drop_undecoded = drop_undecoded
+
         # Track number of messages of each type received.
         # Should be read-only in a test.
         self.message_count = defaultdict(int)
@@ -374,10 +412,16 @@ class P2PInterface(P2PConnection):
                 msgtype = message.msgtype.decode('ascii')
                 self.message_count[msgtype] += 1
                 self.last_message[msgtype] = message
-                getattr(self, 'on_' + msgtype)(message)
+                if isinstance(message, msg_undecoded):
+                    self.on_undecoded(message)
+                else:
+                    getattr(self, 'on_' + msgtype)(message)
             except:
                 print("ERROR delivering %s (%s)" % (repr(message), sys.exc_info()[0]))
                 raise
+            finally:
+                # Wake up any wait_until() predicates that may depend on this message
+                p2p_lock.notify_all()
 
     # Callback methods. Can be overridden by subclasses in individual test
     # cases to provide custom message handling behaviour.
@@ -414,6 +458,7 @@ class P2PInterface(P2PConnection):
     def on_sendcmpct(self, message): pass
     def on_sendheaders(self, message): pass
     def on_tx(self, message): pass
+    def on_undecoded(self, message): pass
     def on_wtxidrelay(self, message): pass
 
     def on_inv(self, message):
@@ -563,7 +608,10 @@ class P2PInterface(P2PConnection):
 # P2PConnection acquires this lock whenever delivering a message to a P2PInterface.
 # This lock should be acquired in the thread running the test logic to synchronize
 # access to any data shared with the P2PInterface or P2PConnection.
-p2p_lock = threading.Lock()
+# It is a condition variable which is notified after every message delivery and
+# connection state change, so that wait_until() can re-evaluate its predicate
+# right away instead of waiting for the next polling interval.
+p2p_lock = threading.Condition(threading.Lock())
 
 
 class NetworkThread(threading.Thread):
@@ -646,6 +694,14 @@ class P2PDataStore(P2PInterface):
         # store of txs. key is txid, value is a CTransaction object
         self.tx_store = {}
         self.getdata_requests = []
+        # Index of the chain in block_store that ends in last_block_hash, used
+        # to answer getheaders. _chain[i] is the hash of the block at height
+        # i above the earliest ancestor in block_store, _chain_pos maps a
+        # block hash back to its position in _chain.
+        self._chain = []
+        self._chain_pos = {}
+        # Serialized headers (in headers message format), keyed by block hash
+        self._header_cache = {}
 
     def on_getdata(self, message):
         """Check for the tx/block in our stores and if found, reply with an inv message."""
@@ -658,6 +714,39 @@ class P2PDataStore(P2PInterface):
             else:
                 logger.debug('getdata message type {} received.'.format(hex(inv.type)))
 
+    def _update_chain_index(self):
+        """Update the chain index so that it ends in last_block_hash.
+
+        Only blocks that are not on the indexed chain yet are visited, so
+        extending the tip or switching to a fork costs time proportional to
+        the number of new blocks rather than to the length of the chain."""
+        if self._chain and self.block_store[self._chain[0]].hashPrevBlock in self.block_store:
+            # An ancestor of the earliest indexed block was added, re-index from scratch
+            self._chain, self._chain_pos = [], {}
+        new_blocks = []
+        block_hash = self.last_block_hash
+        while block_hash in self.block_store and block_hash not in self._chain_pos:
+            new_blocks.append(block_hash)
+            block_hash = self.block_store[block_hash].hashPrevBlock
+        if block_hash in self._chain_pos:
+            # Disconnect the indexed blocks above the fork point
+            fork_pos = self._chain_pos[block_hash]
+            for stale_hash in self._chain[fork_pos + 1:]:
+                del self._chain_pos[stale_hash]
+            del self._chain[fork_pos + 1:]
+        else:
+            logger.debug('block hash {} not found in block store'.format(hex(block_hash) if block_hash else block_hash))
+            self._chain, self._chain_pos = [], {}
+        for block_hash in reversed(new_blocks):
+            self._chain_pos[block_hash] = len(self._chain)
+            self._chain.append(block_hash)
+
+    def _get_serialized_header(self, block_hash):
+        if block_hash not in self._header_cache:
+            # Headers are serialized as blocks without transactions
+            self._header_cache[block_hash] = CBlockHeader.serialize(self.block_store[block_hash]) + ser_compact_size(0)
+        return self._header_cache[block_hash]
+
     def on_getheaders(self, message):
         """Search back through our block store for the locator, and reply with a headers message if found."""
 
@@ -667,27 +756,23 @@ class P2PDataStore(P2PInterface):
         if not self.block_store:
             return
 
-        headers_list = [self.block_store[self.last_block_hash]]
-        while headers_list[-1].sha256 not in locator.vHave:
-            # Walk back through the block store, adding headers to headers_list
-            # as we go.
-            prev_block_hash = headers_list[-1].hashPrevBlock
-            if prev_block_hash in self.block_store:
-                prev_block_header = CBlockHeader(self.block_store[prev_block_hash])
-                headers_list.append(prev_block_header)
-                if prev_block_header.sha256 == hash_stop:
-                    # if this is the hashstop header, stop here
-                    break
-            else:
-                logger.debug('block hash {} not found in block store'.format(hex(prev_block_hash)))
-                break
+        self._update_chain_index()
+        if not self._chain:
+            return
 
-        # Truncate the list if there are too many headers
-        headers_list = headers_list[:-MAX_HEADERS_RESULTS - 1:-1]
-        response = msg_headers(headers_list)
+        # Start at the most recent block on our chain that is in the locator,
+        # or at hash_stop if that comes first when walking back from the tip.
+        # If neither is found, start at the earliest block we have.
+        tip_pos = len(self._chain) - 1
+        start_pos = max([self._chain_pos.get(h, 0) for h in locator.vHave] + [0])
+        stop_pos = self._chain_pos.get(hash_stop, -1)
+        if start_pos < stop_pos < tip_pos:
+            start_pos = stop_pos
 
-        if response is not None:
-            self.send_message(response)
+        # Truncate the list if there are too many headers
+        headers_list = self._chain[start_pos:start_pos + MAX_HEADERS_RESULTS]
+        response = msg_generic(msg_headers.msgtype, ser_compact_size(len(headers_list)) + b"".join(self._get_serialized_header(h) for h in headers_list))
+        self.send_message(response)
 
     def send_blocks_and_test(self, blocks, node, *, success=True, force_send=False, reject_reason=None, expect_disconnect=False, timeout=60):
         """Send blocks to test node and test whether the tip advances.
@@ -788,3 +873,68 @@ class P2PTxInvStore(P2PInterface):
         self.wait_until(lambda: set(self.tx_invs_received.keys()) == set([int(tx, 16) for tx in txns]), timeout=timeout)
         # Flush messages and wait for the getdatas to be processed
         self.sync_with_ping()
+
+
+class P2PSwarm:
+    """A group of P2P connections to a single node, all driven by the shared NetworkThread.
+
+    Messages are serialized once and written to every connection, and waits
+    are done once for the whole group rather than once per connection. Use
+    TestNode.add_p2p_swarm() to create and connect a swarm."""
+
+    def __init__(self, peers):
+        self.peers = list(peers)
+
+    def __len__(self):
+        return len(self.peers)
+
+    def __iter__(self):
+        return iter(self.peers)
+
+    def __getitem__(self, index):
+        return self.peers[index]
+
+    def wait_until(self, test_function_in, *, timeout=60, check_connected=True):
+        """Wait until test_function_in(peer) is true for every peer in the swarm."""
+        def test_function():
+            if check_connected:
+                assert all(p.is_connected for p in self.peers)
+            return all(test_function_in(p) for p in self.peers)
+
+        wait_until_helper(test_function, timeout=timeout, lock=p2p_lock, timeout_factor=self.peers[0].timeout_factor)
+
+    def wait_for_verack(self, timeout=60):
+        self.wait_until(lambda p: "verack" in p.last_message, timeout=timeout)
+
+    def wait_for_disconnect(self, timeout=60):
+        self.wait_until(lambda p: not p.is_connected, timeout=timeout, check_connected=False)
+
+    def send_message(self, message):
+        """Serialize message once and send it over every connection in the swarm."""
+        tmsg = self.peers[0].build_message(message)
+        self.peers[0]._log_message("send", message)
+        self.send_raw_message(tmsg)
+
+    def send_raw_message(self, raw_message_bytes):
+        for p in self.peers:
+            p.send_raw_message(raw_message_bytes)
+
+    def sync_with_ping(self, timeout=60):
+        """Ensure ProcessMessages is called on every connection in the swarm"""
+        for p in self.peers:
+            p.send_message(msg_ping(nonce=p.ping_counter))
+
+        def test_function(p):
+            return p.last_message.get("pong") and p.last_message["pong"].nonce == p.ping_counter
+
+        self.wait_until(test_function, timeout=timeout)
+        for p in self.peers:
+            p.ping_counter += 1
+
+    def send_and_ping(self, message, timeout=60):
+        self.send_message(message)
+        self.sync_with_ping(timeout=timeout)
+
+    def peer_disconnect(self):
+        for p in self.peers:
+            p.peer_disconnect()
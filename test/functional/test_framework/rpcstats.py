@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Utilities for collecting RPC latency and size statistics.
+
+Provides a way to track the latency distribution, request size and response
+size of each RPC method called during testing, per node. Each test script
+writes a summary file into a particular directory, and test_runner.py
+aggregates the summaries of all test scripts.
+"""
+
+from collections import Counter
+import json
+import math
+import os
+import threading
+import time
+import unittest
+
+from .authproxy import (
+    JSONRPCException,
+    ResponseStats,
+)
+
+SUMMARY_FILE_PREFIX = 'rpcstats.'
+# Resolution of the latency histograms: a bucket covers a factor of 2**(1/4)
+BUCKETS_PER_OCTAVE = 4
+
+
+def latency_bucket(latency):
+    """Return the histogram bucket of a latency in seconds."""
+    micros = latency * 1e6
+    if micros < 1:
+        return 0
+    return int(math.log2(micros) * BUCKETS_PER_OCTAVE) + 1
+
+
+def bucket_upper_bound(bucket):
+    """Return the upper bound, in seconds, of the latencies in a histogram bucket."""
+    return 2 ** (bucket / BUCKETS_PER_OCTAVE) / 1e6
+
+
+class MethodStats():
+    """Latency histogram and byte counters of the calls of one RPC method."""
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.histogram = Counter()
+
+    def record(self, latency, request_bytes, response_bytes, error=False):
+        self.count += 1
+        self.errors += error
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+        self.histogram[latency_bucket(latency)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total_latency += other.total_latency
+        self.max_latency = max(self.max_latency, other.max_latency)
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        self.histogram.update(other.histogram)
+
+    def percentile(self, pct):
+        """Return an upper bound of the pct-th percentile latency, in seconds."""
+        if not self.count:
+            return float('nan')
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(bucket_upper_bound(bucket), self.max_latency)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_latency': self.total_latency,
+            'max_latency': self.max_latency,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'histogram': {str(bucket): n for bucket, n in sorted(self.histogram.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        stats = cls()
+        for key in ['count', 'errors', 'total_latency', 'max_latency', 'request_bytes', 'response_bytes']:
+            setattr(stats, key, d[key])
+        stats.histogram = Counter({int(bucket): n for bucket, n in d['histogram'].items()})
+        return stats
+
+
+class RPCStats():
+    """Thread-safe collection of MethodStats, keyed by node number and RPC method."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.nodes = {}
+
+    def record(self, node_number, method, latency, request_bytes, response_bytes, error=False):
+        with self._lock:
+            methods = self.nodes.setdefault(node_number, {})
+            methods.setdefault(method, MethodStats()).record(latency, request_bytes, response_bytes, error)
+
+    def write_summary(self, dirname, test_name):
+        """Write the statistics to a file unique to the test process ID."""
+        filename = os.path.join(dirname, "%spid%s.json" % (SUMMARY_FILE_PREFIX, os.getpid()))
+        with self._lock:
+            summary = {
+                'test': test_name,
+                'nodes': {str(n): {method: stats.to_dict() for method, stats in methods.items()} for n, methods in self.nodes.items()},
+            }
+        with open(filename, 'w', encoding='utf8') as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        return filename
+
+
+def read_summaries(dirname):
+    """Aggregate the summary files in dirname.
+
+    Returns:
+        dict. RPC method -> MethodStats, merged over all nodes and tests.
+    """
+    methods = {}
+    for filename in sorted(os.listdir(dirname)):
+        if not filename.startswith(SUMMARY_FILE_PREFIX):
+            continue
+        with open(os.path.join(dirname, filename), 'r', encoding='utf8') as f:
+            summary = json.load(f)
+        for node_methods in summary['nodes'].values():
+            for method, d in node_methods.items():
+                methods.setdefault(method, MethodStats()).merge(MethodStats.from_dict(d))
+    return methods
+
+
+class AuthServiceProxyStatsWrapper():
+    """
+    An object that wraps AuthServiceProxy (or AuthServiceProxyWrapper) to
+    record the latency and size of each RPC call.
+
+    """
+    def __init__(self, auth_service_proxy_instance, rpc_stats, node_number):
+        self.auth_service_proxy_instance = auth_service_proxy_instance
+        self.rpc_stats = rpc_stats
+        self.node_number = node_number
+
+    def __getattr__(self, name):
+        return_val = getattr(self.auth_service_proxy_instance, name)
+        if not isinstance(return_val, type(self.auth_service_proxy_instance)):
+            # If proxy getattr returned an unwrapped value, do the same here.
+            return return_val
+        return AuthServiceProxyStatsWrapper(return_val, self.rpc_stats, self.node_number)
+
+    def __call__(self, *args, **kwargs):
+        start_time = time.time()
+        error = True
+        # Only a call that returned or got an error from the node has
+        # exchanged the bytes in the last_* stats of the proxy. After other
+        # errors (e.g. a refused connection) they may be left over from the
+        # previous call.
+        sent = False
+        try:
+            return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+            error = False
+            sent = True
+            return return_val
+        except JSONRPCException:
+            sent = True
+            raise
+        finally:
+            latency = time.time() - start_time
+            request_bytes, response_bytes = 0, 0
+            if sent:
+                response_stats = self.auth_service_proxy_instance.get_response_stats()
+                request_bytes, response_bytes = response_stats['last_request_bytes'], response_stats['last_bytes']
+            self.rpc_stats.record(self.node_number, self.auth_service_proxy_instance._service_name, latency,
+                                  request_bytes, response_bytes, error)
+
+    def __truediv__(self, relative_uri):
+        return AuthServiceProxyStatsWrapper(self.auth_service_proxy_instance / relative_uri,
+                                            self.rpc_stats, self.node_number)
+
+    def get_request(self, *args, **kwargs):
+        return self.auth_service_proxy_instance.get_request(*args, **kwargs)
+
+
+class TestFrameworkRPCStats(unittest.TestCase):
+    def test_percentile(self):
+        stats = MethodStats()
+        for micros in range(1, 1001):
+            stats.record(micros / 1e6, 100, 1000)
+        self.assertEqual(stats.count, 1000)
+        self.assertEqual(stats.request_bytes, 100000)
+        self.assertEqual(stats.max_latency, 1000 / 1e6)
+        # Percentiles are upper bounds within one bucket of the exact value
+        for pct in [1, 50, 90, 99, 100]:
+            exact = pct * 10 / 1e6
+            self.assertGreaterEqual(stats.percentile(pct), exact)
+            self.assertLessEqual(stats.percentile(pct), exact * 2 ** (1 / BUCKETS_PER_OCTAVE))
+
+    def test_merge_roundtrip(self):
+        a, b = MethodStats(), MethodStats()
+        a.record(0.001, 10, 20)
+        b.record(0.5, 30, 40, error=True)
+        a.merge(MethodStats.from_dict(json.loads(json.dumps(b.to_dict()))))
+        self.assertEqual((a.count, a.errors, a.request_bytes, a.response_bytes), (2, 1, 40, 60))
+        self.assertEqual(a.max_latency, 0.5)
+        self.assertEqual(a.percentile(50), bucket_upper_bound(latency_bucket(0.001)))
+        self.assertEqual(a.percentile(100), 0.5)
+
+    def test_wrapper_bytes(self):
+        class FakeProxy():
+            _service_name = 'echo'
+
+            def __init__(self):
+                self.stats = ResponseStats()
+                self.result = None
+
+            def __call__(self, request_bytes, response_bytes=None, exception=None):
+                if request_bytes is not None:
+                    self.stats.record_request(request_bytes)
+                if response_bytes is not None:
+                    self.stats.record(response_bytes, 0.0)
+                if exception is not None:
+                    raise exception
+                return self.result
+
+            def get_response_stats(self):
+                return self.stats.get_stats()
+
+        rpc_stats = RPCStats()
+        wrapper = AuthServiceProxyStatsWrapper(FakeProxy(), rpc_stats, 0)
+        wrapper(10, 20)
+        # An error from the node counts the bytes of its response
+        with self.assertRaises(JSONRPCException):
+            wrapper(30, 40, JSONRPCException({'code': -8, 'message': 'failed'}))
+        # A timeout after the request was sent counts no response bytes
+        with self.assertRaises(JSONRPCException):
+            wrapper(50, None, JSONRPCException({'code': -344, 'message': 'timeout'}))
+        # A transport error does not count the bytes of the previous call
+        with self.assertRaises(ConnectionRefusedError):
+            wrapper(None, None, ConnectionRefusedError())
+        stats = rpc_stats.nodes[0]['echo']
+        self.assertEqual((stats.count, stats.errors), (4, 3))
+        self.assertEqual((stats.request_bytes, stats.response_bytes), (10 + 30 + 50, 20 + 40))
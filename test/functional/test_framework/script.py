@@ -16,8 +16,11 @@ from typing import List, Dict
 from .key import TaggedHash, tweak_add_pubkey
 
 from .messages import (
+    COutPoint,
     CTransaction,
+    CTxIn,
     CTxOut,
+    FromHex,
     hash256,
     ser_string,
     ser_uint256,
@@ -669,33 +672,77 @@ def LegacySignatureHash(script, txTo, inIdx, hashtype):
 
     return (hash, None)
 
-# TODO: Allow cached hashPrevouts/hashSequence/hashOutputs to be provided.
-# Performance optimization probably not necessary for python tests, however.
+class PrecomputedTransactionData():
+    """The hashes of a transaction that are shared by the signature hashes of all its inputs.
+
+    Corresponds to PrecomputedTransactionData in bitcoind. Passing the same
+    object to SegwitV0SignatureHash() or TaprootSignatureHash() for every
+    input makes signing all inputs linear in the size of the transaction,
+    instead of quadratic. The hashes are computed on first use, so the
+    transaction must not be modified (apart from scriptSigs and witnesses)
+    after that. spent_utxos is only needed for taproot signature hashes."""
+    def __init__(self, txTo, spent_utxos=None):
+        self.txTo = txTo
+        self.spent_utxos = spent_utxos
+        self._hashes = {}
+
+    def _single_hash(self, name, serialize):
+        if name not in self._hashes:
+            self._hashes[name] = sha256(serialize())
+        return self._hashes[name]
+
+    @property
+    def prevouts_single_hash(self):
+        return self._single_hash("prevouts", lambda: b"".join(i.prevout.serialize() for i in self.txTo.vin))
+
+    @property
+    def sequences_single_hash(self):
+        return self._single_hash("sequences", lambda: b"".join(struct.pack("<I", i.nSequence) for i in self.txTo.vin))
+
+    @property
+    def outputs_single_hash(self):
+        return self._single_hash("outputs", lambda: b"".join(o.serialize() for o in self.txTo.vout))
+
+    @property
+    def spent_amounts_single_hash(self):
+        return self._single_hash("spent_amounts", lambda: b"".join(struct.pack("<q", u.nValue) for u in self.spent_utxos))
+
+    @property
+    def spent_scripts_single_hash(self):
+        return self._single_hash("spent_scripts", lambda: b"".join(ser_string(u.scriptPubKey) for u in self.spent_utxos))
+
+    # The BIP143 hashes are double SHA256 hashes of the same data.
+    @property
+    def hashPrevouts(self):
+        return uint256_from_str(sha256(self.prevouts_single_hash))
+
+    @property
+    def hashSequence(self):
+        return uint256_from_str(sha256(self.sequences_single_hash))
+
+    @property
+    def hashOutputs(self):
+        return uint256_from_str(sha256(self.outputs_single_hash))
+
 # Note that this corresponds to sigversion == 1 in EvalScript, which is used
 # for version 0 witnesses.
-def SegwitV0SignatureHash(script, txTo, inIdx, hashtype, amount):
+def SegwitV0SignatureHash(script, txTo, inIdx, hashtype, amount, txdata=None):
+    if txdata is None:
+        txdata = PrecomputedTransactionData(txTo)
+    assert txdata.txTo is txTo
 
     hashPrevouts = 0
     hashSequence = 0
     hashOutputs = 0
 
     if not (hashtype & SIGHASH_ANYONECANPAY):
-        serialize_prevouts = bytes()
-        for i in txTo.vin:
-            serialize_prevouts += i.prevout.serialize()
-        hashPrevouts = uint256_from_str(hash256(serialize_prevouts))
+        hashPrevouts = txdata.hashPrevouts
 
     if (not (hashtype & SIGHASH_ANYONECANPAY) and (hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_sequence = bytes()
-        for i in txTo.vin:
-            serialize_sequence += struct.pack("<I", i.nSequence)
-        hashSequence = uint256_from_str(hash256(serialize_sequence))
+        hashSequence = txdata.hashSequence
 
     if ((hashtype & 0x1f) != SIGHASH_SINGLE and (hashtype & 0x1f) != SIGHASH_NONE):
-        serialize_outputs = bytes()
-        for o in txTo.vout:
-            serialize_outputs += o.serialize()
-        hashOutputs = uint256_from_str(hash256(serialize_outputs))
+        hashOutputs = txdata.hashOutputs
     elif ((hashtype & 0x1f) == SIGHASH_SINGLE and inIdx < len(txTo.vout)):
         serialize_outputs = txTo.vout[inIdx].serialize()
         hashOutputs = uint256_from_str(hash256(serialize_outputs))
@@ -742,9 +789,36 @@ class TestFrameworkScript(unittest.TestCase):
         for value in values:
             self.assertEqual(CScriptNum.decode(CScriptNum.encode(CScriptNum(value))), value)
 
-def TaprootSignatureHash(txTo, spent_utxos, hash_type, input_index = 0, scriptpath = False, script = CScript(), codeseparator_pos = -1, annex = None, leaf_ver = LEAF_VERSION_TAPSCRIPT):
+    def test_segwitv0_sighash(self):
+        # Native P2WPKH example from BIP143
+        tx = FromHex(CTransaction(), "0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffffef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac11000000")
+        script_code = CScript(bytes.fromhex("76a9141d0f172a0ecb48aee1be1f2687d2963ae33f71a188ac"))
+        sighash = "c37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670"
+        self.assertEqual(SegwitV0SignatureHash(script_code, tx, 1, SIGHASH_ALL, 600000000).hex(), sighash)
+        self.assertEqual(SegwitV0SignatureHash(script_code, tx, 1, SIGHASH_ALL, 600000000, PrecomputedTransactionData(tx)).hex(), sighash)
+
+    def test_precomputed_transaction_data(self):
+        """Check that sharing a PrecomputedTransactionData between inputs gives the same signature hashes."""
+        tx = CTransaction()
+        tx.vin = [CTxIn(COutPoint(n, n), nSequence=n) for n in range(3)]
+        tx.vout = [CTxOut(n * 1000, CScript([n, OP_TRUE])) for n in range(2)]
+        spent_utxos = [CTxOut(n * 2000, CScript([OP_1, bytes([n]) * 32])) for n in range(3)]
+        txdata = PrecomputedTransactionData(tx, spent_utxos)
+        for i in range(len(tx.vin)):
+            for hashtype in [SIGHASH_ALL, SIGHASH_NONE, SIGHASH_SINGLE, SIGHASH_ALL | SIGHASH_ANYONECANPAY, SIGHASH_SINGLE | SIGHASH_ANYONECANPAY]:
+                self.assertEqual(SegwitV0SignatureHash(CScript([OP_TRUE]), tx, i, hashtype, 1000, txdata),
+                                 SegwitV0SignatureHash(CScript([OP_TRUE]), tx, i, hashtype, 1000))
+                self.assertEqual(TaprootSignatureHash(tx, spent_utxos, hashtype, i, txdata=txdata),
+                                 TaprootSignatureHash(tx, spent_utxos, hashtype, i))
+            self.assertEqual(TaprootSignatureHash(tx, spent_utxos, SIGHASH_DEFAULT, i, scriptpath=True, script=CScript([OP_TRUE]), txdata=txdata),
+                             TaprootSignatureHash(tx, spent_utxos, SIGHASH_DEFAULT, i, scriptpath=True, script=CScript([OP_TRUE])))
+
+def TaprootSignatureHash(txTo, spent_utxos, hash_type, input_index = 0, scriptpath = False, script = CScript(), codeseparator_pos = -1, annex = None, leaf_ver = LEAF_VERSION_TAPSCRIPT, txdata = None):
     assert (len(txTo.vin) == len(spent_utxos))
     assert (input_index < len(txTo.vin))
+    if txdata is None:
+        txdata = PrecomputedTransactionData(txTo, spent_utxos)
+    assert txdata.txTo is txTo and txdata.spent_utxos is not None
     out_type = SIGHASH_ALL if hash_type == 0 else hash_type & 3
     in_type = hash_type & SIGHASH_ANYONECANPAY
     spk = spent_utxos[input_index].scriptPubKey
@@ -752,12 +826,12 @@ def TaprootSignatureHash(txTo, spent_utxos, hash_type, input_index = 0, scriptpa
     ss += struct.pack("<i", txTo.nVersion)
     ss += struct.pack("<I", txTo.nLockTime)
     if in_type != SIGHASH_ANYONECANPAY:
-        ss += sha256(b"".join(i.prevout.serialize() for i in txTo.vin))
-        ss += sha256(b"".join(struct.pack("<q", u.nValue) for u in spent_utxos))
-        ss += sha256(b"".join(ser_string(u.scriptPubKey) for u in spent_utxos))
-        ss += sha256(b"".join(struct.pack("<I", i.nSequence) for i in txTo.vin))
+        ss += txdata.prevouts_single_hash
+        ss += txdata.spent_amounts_single_hash
+        ss += txdata.spent_scripts_single_hash
+        ss += txdata.sequences_single_hash
     if out_type == SIGHASH_ALL:
-        ss += sha256(b"".join(o.serialize() for o in txTo.vout))
+        ss += txdata.outputs_single_hash
     spend_type = 0
     if annex is not None:
         spend_type |= 1
@@ -2,13 +2,37 @@
 # Copyright (c) 2017 Pieter Wuille
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Reference implementation for Bech32/Bech32m and segwit addresses."""
+"""Reference implementation for Bech32/Bech32m and segwit addresses.
+
+encode_segwit_addresses() and decode_segwit_addresses() convert many
+addresses at once. They convert between witness programs and 5-bit groups
+with base64's base32 codec and translation tables, and compute the
+checksums of up to BECH32_BATCH_SIZE addresses of the same length at once,
+with one address per LANE_BYTES-byte lane of a single integer."""
+import base64
 import unittest
 from enum import Enum
 
 CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 BECH32_CONST = 1
 BECH32M_CONST = 0x2bc830a3
+GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+# POLYMOD_TABLE[top] is the xor of the generators selected by the bits of top
+POLYMOD_TABLE = [0] * 32
+for _top in range(32):
+    for _i in range(5):
+        if (_top >> _i) & 1:
+            POLYMOD_TABLE[_top] ^= GENERATOR[_i]
+CHARSET_SET = frozenset(CHARSET)
+BECH32_BATCH_SIZE = 1024
+# The checksum state has 30 bits, so each address fits a 32-bit lane
+LANE_BYTES = 4
+# Translation tables between the CHARSET characters, their values, and the
+# RFC 4648 base32 alphabet of base64.b32encode()
+CHARSET_TO_VALUES = bytes.maketrans(CHARSET.encode(), bytes(range(32)))
+VALUES_TO_CHARSET = bytes.maketrans(bytes(range(32)), CHARSET.encode())
+BASE32_TO_CHARSET = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", CHARSET.encode())
+CHARSET_TO_BASE32 = bytes.maketrans(CHARSET.encode(), b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567")
 
 class Encoding(Enum):
     """Enumeration type to list the various supported encodings."""
@@ -18,13 +42,9 @@ class Encoding(Enum):
 
 def bech32_polymod(values):
     """Internal function that computes the Bech32 checksum."""
-    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
     chk = 1
     for value in values:
-        top = chk >> 25
-        chk = (chk & 0x1ffffff) << 5 ^ value
-        for i in range(5):
-            chk ^= generator[i] if ((top >> i) & 1) else 0
+        chk = (chk & 0x1ffffff) << 5 ^ value ^ POLYMOD_TABLE[chk >> 25]
     return chk
 
 
@@ -124,6 +144,113 @@ def encode_segwit_address(hrp, witver, witprog):
         return None
     return ret
 
+def _to_lanes(column):
+    """Return an integer with the bytes of column in the low bytes of its lanes."""
+    buf = bytearray(len(column) * LANE_BYTES)
+    buf[::LANE_BYTES] = column
+    return int.from_bytes(buf, 'little')
+
+
+def _bech32_polymod_lanes(hrp, rows, extra_columns=0):
+    """Compute bech32_polymod(bech32_hrp_expand(hrp) + list(row) + [0] * extra_columns) for each row of values.
+
+    All rows must have the same length. Returns the results in the lanes of an integer."""
+    ones = _to_lanes(b'\x01' * len(rows))
+    low_mask = ones * 0x1ffffff
+    chk = ones * bech32_polymod(bech32_hrp_expand(hrp))
+    joined = b''.join(rows)
+    length = len(rows[0])
+    for j in range(length + extra_columns):
+        top = chk >> 25
+        chk = (chk & low_mask) << 5
+        if j < length:
+            chk ^= _to_lanes(joined[j::length])
+        for i in range(5):
+            chk ^= ((top >> i) & ones) * GENERATOR[i]
+    return chk
+
+
+def _batches(items, key):
+    """Yield lists of up to BECH32_BATCH_SIZE indexes of items with the same key (None keys are skipped)."""
+    groups = {}
+    for i, item in enumerate(items):
+        k = key(item)
+        if k is not None:
+            groups.setdefault(k, []).append(i)
+    for indexes in groups.values():
+        for start in range(0, len(indexes), BECH32_BATCH_SIZE):
+            yield indexes[start:start + BECH32_BATCH_SIZE]
+
+
+def _is_valid_program(witver, length):
+    return 0 <= witver <= 16 and 2 <= length <= 40 and (witver > 0 or length in [20, 32])
+
+
+def encode_segwit_addresses(hrp, witver, witprogs):
+    """Encode a list of witness programs of the same version as segwit addresses.
+
+    Returns the same as [encode_segwit_address(hrp, witver, witprog) for witprog in witprogs]."""
+    addrs = [None] * len(witprogs)
+    encoding = Encoding.BECH32 if witver == 0 else Encoding.BECH32M
+    const = BECH32M_CONST if encoding == Encoding.BECH32M else BECH32_CONST
+    prefix = hrp + '1' + CHARSET[witver] if 0 <= witver <= 16 else None
+    for batch in _batches(witprogs, lambda witprog: len(witprog) if _is_valid_program(witver, len(witprog)) else None):
+        data = [bytes([witver]) + base64.b32encode(bytes(witprogs[i])).rstrip(b'=').translate(BASE32_TO_CHARSET).translate(CHARSET_TO_VALUES) for i in batch]
+        ones = _to_lanes(b'\x01' * len(batch))
+        chk = _bech32_polymod_lanes(hrp, data, 6) ^ (ones * const)
+        # checksum[i::6] is the i-th checksum character of each address
+        checksum = bytearray(len(batch) * 6)
+        for i in range(6):
+            column = ((chk >> 5 * (5 - i)) & (ones * 31)).to_bytes(len(batch) * LANE_BYTES, 'little')[::LANE_BYTES]
+            checksum[i::6] = column.translate(VALUES_TO_CHARSET)
+        checksum = checksum.decode()
+        for k, (i, values) in enumerate(zip(batch, data)):
+            addrs[i] = prefix + values[1:].translate(VALUES_TO_CHARSET).decode() + checksum[6 * k:6 * k + 6]
+    return addrs
+
+
+def _decode_data(hrp, addr):
+    """Return the data part of a segwit address for hrp as bytes, or None if it is malformed (see bech32_decode)."""
+    # The same character checks as in bech32_decode()
+    if (not all(33 <= ord(x) <= 126 for x in addr) or
+            (addr.lower() != addr and addr.upper() != addr)):
+        return None
+    addr = addr.lower()
+    if not addr.startswith(hrp + '1') or len(addr) > 90 or not CHARSET_SET.issuperset(addr[len(hrp) + 1:]):
+        return None
+    num_symbols = len(addr) - len(hrp) - 8
+    # The program must be a whole number of bytes, with fewer than 5 bits of padding
+    if not 2 <= num_symbols * 5 // 8 <= 40 or (num_symbols * 5 // 8 * 8 + 4) // 5 != num_symbols:
+        return None
+    return addr[len(hrp) + 1:].encode().translate(CHARSET_TO_VALUES)
+
+
+def decode_segwit_addresses(hrp, addrs):
+    """Decode a list of segwit addresses.
+
+    Returns the same as [decode_segwit_address(hrp, addr) for addr in addrs],
+    except that the programs are bytes instead of lists of integers."""
+    results = [(None, None)] * len(addrs)
+    data = [_decode_data(hrp, addr) for addr in addrs]
+    for batch in _batches(data, lambda values: None if values is None else len(values)):
+        chk = _bech32_polymod_lanes(hrp, [data[i] for i in batch]).to_bytes(len(batch) * LANE_BYTES, 'little')
+        for k, i in enumerate(batch):
+            values = data[i]
+            check = int.from_bytes(chk[k * LANE_BYTES:(k + 1) * LANE_BYTES], 'little')
+            witver = values[0]
+            if check != (BECH32_CONST if witver == 0 else BECH32M_CONST):
+                continue
+            num_symbols = len(values) - 7
+            if values[num_symbols] & ((1 << (num_symbols * 5 % 8)) - 1):
+                # Non-zero padding
+                continue
+            base32 = values[1:-6].translate(VALUES_TO_CHARSET).translate(CHARSET_TO_BASE32)
+            witprog = base64.b32decode(base32 + b'=' * (-len(base32) % 8))
+            if _is_valid_program(witver, len(witprog)):
+                results[i] = (witver, witprog)
+    return results
+
+
 class TestFrameworkScript(unittest.TestCase):
     def test_segwit_encode_decode(self):
         def test_python_bech32(addr):
@@ -139,3 +266,15 @@ class TestFrameworkScript(unittest.TestCase):
         test_python_bech32('bcrt1qft5p2uhsdcdc3l2ua4ap5qqfg4pjaqlp250x7us7a8qqhrxrxfsqseac85')
         # P2TR
         test_python_bech32('bcrt1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqc8gma6')
+
+    def test_segwit_batch_encode_decode(self):
+        programs = [bytes([i]) * 20 for i in range(3)] + [bytes([i]) * 32 for i in range(3)] + [bytes(21), [1, 2]]
+        for witver in [0, 1, 16, 17]:
+            addrs = encode_segwit_addresses("bcrt", witver, programs)
+            self.assertEqual(addrs, [encode_segwit_address("bcrt", witver, program) for program in programs])
+        addrs = [addr for addr in addrs + encode_segwit_addresses("bcrt", 0, programs) if addr is not None]
+        # Invalid addresses: wrong hrp, mixed case, bad checksum. Upper case addresses are valid.
+        addrs += ["tb" + addrs[0][4:], "bcrt1" + addrs[0][5:].upper(), addrs[0][:-1] + "q", addrs[0].upper()]
+        self.assertEqual(decode_segwit_addresses("bcrt", addrs),
+                         [(witver, bytes(program)) if witver is not None else (None, None)
+                          for witver, program in (decode_segwit_address("bcrt", addr) for addr in addrs)])
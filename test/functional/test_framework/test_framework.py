@@ -4,9 +4,11 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """Base class for RPC testing."""
 
+import concurrent.futures
 import configparser
 from enum import Enum
 import argparse
+import json
 import logging
 import os
 import pdb
@@ -22,6 +24,8 @@ from typing import List
 from .address import ADDRESS_BCRT1_P2WSH_OP_TRUE
 from .authproxy import JSONRPCException
 from . import coverage
+from .fixtures import get_fixture_dir
+from . import rpcstats
 from .p2p import NetworkThread
 from .test_node import TestNode
 from .util import (
@@ -29,6 +33,7 @@ from .util import (
     PortSeed,
     assert_equal,
     check_json_precision,
+    copy_datadir,
     get_datadir_path,
     initialize_datadir,
     p2p_port,
@@ -101,6 +106,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.supports_cli = True
         self.bind_to_localhost_only = True
         self.parse_args()
+        self.rpc_stats = None if self.options.rpcstatsdir is None else rpcstats.RPCStats()
         self.default_wallet_name = "default_wallet" if self.options.descriptors else ""
         self.wallet_data_filename = "wallet.dat"
         # Optional list of wallet names that can be set in set_test_params to
@@ -112,6 +118,11 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         # By default the wallet is not required. Set to true by skip_if_no_wallet().
         # When False, we ignore wallet_names regardless of what it is.
         self.requires_wallet = False
+        # Optional ChainFixture (see fixtures.py) to initialize the nodes from,
+        # instead of the 199-block cache. Data returned by the fixture build
+        # is available as self.fixture_data.
+        self.chain_fixture = None
+        self.fixture_data = None
         self.set_test_params()
         assert self.wallet_names is None or len(self.wallet_names) <= self.num_nodes
         if self.options.timeout_factor == 0 :
@@ -172,6 +183,8 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                             help="Force test of previous releases (default: %(default)s)")
         parser.add_argument("--coveragedir", dest="coveragedir",
                             help="Write tested RPC commands into this directory")
+        parser.add_argument("--rpcstatsdir", dest="rpcstatsdir",
+                            help="Write per-RPC-method latency and size statistics into this directory")
         parser.add_argument("--configfile", dest="configfile",
                             default=os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/../../config.ini"),
                             help="Location of the test framework config file (default: %(default)s)")
@@ -297,6 +310,10 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 node.cleanup_on_exit = False
             self.log.info("Note: bitcoinds were not stopped and may still be running")
 
+        if self.rpc_stats is not None:
+            filename = self.rpc_stats.write_summary(self.options.rpcstatsdir, os.path.basename(sys.argv[0]))
+            self.log.debug("Wrote RPC statistics to {}".format(filename))
+
         should_clean_up = (
             not self.options.nocleanup and
             not self.options.noshutdown and
@@ -363,6 +380,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """Override this method to customize blockchain setup"""
         self.log.info("Initializing test directory " + self.options.tmpdir)
         if self.setup_clean_chain:
+            assert self.chain_fixture is None, "A chain fixture can not be used with setup_clean_chain"
             self._initialize_chain_clean()
         else:
             self._initialize_chain()
@@ -397,7 +415,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         self.start_nodes()
         if self.requires_wallet:
             self.import_deterministic_coinbase_privkeys()
-        if not self.setup_clean_chain:
+        if not self.setup_clean_chain and self.chain_fixture is None:
             for n in self.nodes:
                 assert_equal(n.getblockchaininfo()["blocks"], 199)
             # To ensure that all nodes are out of IBD, the most recent block
@@ -482,6 +500,7 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 bitcoin_cli=binary_cli[i],
                 version=versions[i],
                 coverage_dir=self.options.coveragedir,
+                rpc_stats=self.rpc_stats,
                 cwd=self.options.tmpdir,
                 extra_conf=extra_confs[i],
                 extra_args=extra_args[i],
@@ -618,17 +637,28 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         sync_blocks needs to be called with an rpc_connections set that has least
         one node already synced to the latest, stable tip, otherwise there's a
         chance it might return before all nodes are stably synced.
+
+        Instead of polling, the nodes that are behind long-poll (for at most
+        `wait` seconds at a time) with waitforblock for the tip with the most
+        work, concurrently.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
-        while time.time() <= stop_time:
-            best_hash = [x.getbestblockhash() for x in rpc_connections]
+        while True:
+            best_hash = self._call_concurrently(rpc_connections, lambda x: x.getbestblockhash())
             if best_hash.count(best_hash[0]) == len(rpc_connections):
                 return
+            if time.time() > stop_time:
+                break
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            target = max(set(best_hash), key=lambda h: int(rpc_connections[best_hash.index(h)].getblockheader(h)['chainwork'], 16))
+            poll_ms = max(1, int(min(wait, stop_time - time.time()) * 1000))
+            self._call_concurrently(
+                [x for x, h in zip(rpc_connections, best_hash) if h != target],
+                lambda x: x.waitforblock(target, poll_ms),
+            )
         raise AssertionError("Block sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(b) for b in best_hash),
@@ -638,20 +668,28 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
         """
         Wait until everybody has the same transactions in their memory
         pools
+
+        The mempool sizes are compared first, and the full mempools only when
+        the sizes match. The polling interval starts short and backs off to
+        `wait` seconds.
         """
         rpc_connections = nodes or self.nodes
         timeout = int(timeout * self.options.timeout_factor)
         stop_time = time.time() + timeout
+        poll_interval = 0.01
         while time.time() <= stop_time:
-            pool = [set(r.getrawmempool()) for r in rpc_connections]
-            if pool.count(pool[0]) == len(rpc_connections):
-                if flush_scheduler:
-                    for r in rpc_connections:
-                        r.syncwithvalidationinterfacequeue()
-                return
+            info = [(i['size'], i['bytes']) for i in self._call_concurrently(rpc_connections, lambda r: r.getmempoolinfo())]
+            if info.count(info[0]) == len(rpc_connections):
+                pool = self._call_concurrently(rpc_connections, lambda r: set(r.getrawmempool()))
+                if pool.count(pool[0]) == len(rpc_connections):
+                    if flush_scheduler:
+                        self._call_concurrently(rpc_connections, lambda r: r.syncwithvalidationinterfacequeue())
+                    return
             # Check that each peer has at least one connection
             assert (all([len(x.getpeerinfo()) for x in rpc_connections]))
-            time.sleep(wait)
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, wait)
+        pool = [set(r.getrawmempool()) for r in rpc_connections]
         raise AssertionError("Mempool sync timed out after {}s:{}".format(
             timeout,
             "".join("\n  {!r}".format(m) for m in pool),
@@ -666,6 +704,14 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
 
     # Private helper methods. These should not be accessed by the subclass test scripts.
 
+    @staticmethod
+    def _call_concurrently(rpc_connections, fn):
+        """Call fn on each of rpc_connections, each in its own thread, and return the results in order."""
+        if len(rpc_connections) <= 1:
+            return [fn(x) for x in rpc_connections]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(rpc_connections)) as executor:
+            return list(executor.map(fn, rpc_connections))
+
     def _start_logging(self):
         # Add logger and logging handlers
         self.log = logging.getLogger('TestFramework')
@@ -761,12 +807,63 @@ class BitcoinTestFramework(metaclass=BitcoinTestMetaClass):
                 if entry not in ['chainstate', 'blocks', 'indexes']:  # Only indexes, chainstate and blocks folders
                     os.remove(cache_path(entry))
 
+        if self.chain_fixture is not None:
+            cache_node_dir = self._get_chain_fixture(cache_node_dir)
+            with open(os.path.join(cache_node_dir, 'fixture.json'), 'r', encoding='utf8') as f:
+                self.fixture_data = json.load(f)['data']
+
         for i in range(self.num_nodes):
-            self.log.debug("Copy cache directory {} to node {}".format(cache_node_dir, i))
             to_dir = get_datadir_path(self.options.tmpdir, i)
-            shutil.copytree(cache_node_dir, to_dir)
+            counts = copy_datadir(cache_node_dir, to_dir)
+            self.log.debug("Copied cache directory {} to node {} ({} files linked, {} cloned, {} copied)".format(
+                cache_node_dir, i, counts['linked'], counts['cloned'], counts['copied']))
             initialize_datadir(self.options.tmpdir, i, self.chain)  # Overwrite port/rpcport in bitcoin.conf
 
+    def _get_chain_fixture(self, cache_node_dir):
+        """Return the datadir of self.chain_fixture in the cache directory, building it from cache_node_dir if it does not exist yet."""
+        fixture = self.chain_fixture
+
+        def build_datadir(build_dir):
+            self.log.info("Building chain fixture {} {}".format(fixture.name, fixture.params))
+            node_dir = get_datadir_path(build_dir, 0)
+            copy_datadir(cache_node_dir, node_dir)
+            initialize_datadir(build_dir, 0, self.chain)
+            node = TestNode(
+                0,
+                node_dir,
+                chain=self.chain,
+                extra_conf=["bind=127.0.0.1"],
+                extra_args=['-disablewallet'] + fixture.extra_args,
+                rpchost=None,
+                timewait=self.rpc_timeout,
+                timeout_factor=self.options.timeout_factor,
+                bitcoind=self.options.bitcoind,
+                bitcoin_cli=self.options.bitcoincli,
+                coverage_dir=None,
+                cwd=self.options.tmpdir,
+                descriptors=self.options.descriptors,
+            )
+            node.start()
+            node.wait_for_rpc_connection()
+            data = fixture.build(node, **fixture.params)
+            # The mempool is written to mempool.dat on shutdown
+            node.stop_node()
+
+            # Only keep the chain state and the mempool
+            chain_dir = os.path.join(node_dir, self.chain)
+            for entry in os.listdir(chain_dir):
+                if entry in ['chainstate', 'blocks', 'indexes', 'mempool.dat']:
+                    continue
+                if os.path.isdir(os.path.join(chain_dir, entry)):
+                    shutil.rmtree(os.path.join(chain_dir, entry))
+                else:
+                    os.remove(os.path.join(chain_dir, entry))
+            with open(os.path.join(node_dir, 'fixture.json'), 'w', encoding='utf8') as f:
+                json.dump({'name': fixture.name, 'params': fixture.params, 'data': data}, f)
+            return node_dir
+
+        return get_fixture_dir(self.options.cachedir, fixture, build_datadir)
+
     def _initialize_chain_clean(self):
         """Initialize empty blockchain for use by the test.
 
@@ -23,7 +23,7 @@ import sys
 
 from .authproxy import JSONRPCException
 from .descriptors import descsum_create
-from .p2p import P2P_SUBVERSION
+from .p2p import P2P_SUBVERSION, P2PInterface, P2PSwarm
 from .util import (
     MAX_NODES,
     assert_equal,
@@ -64,7 +64,7 @@ class TestNode():
     To make things easier for the test writer, any unrecognised messages will
     be dispatched to the RPC connection."""
 
-    def __init__(self, i, datadir, *, chain, rpchost, timewait, timeout_factor, bitcoind, bitcoin_cli, coverage_dir, cwd, extra_conf=None, extra_args=None, use_cli=False, start_perf=False, use_valgrind=False, version=None, descriptors=False):
+    def __init__(self, i, datadir, *, chain, rpchost, timewait, timeout_factor, bitcoind, bitcoin_cli, coverage_dir, cwd, rpc_stats=None, extra_conf=None, extra_args=None, use_cli=False, start_perf=False, use_valgrind=False, version=None, descriptors=False):
         """
         Kwargs:
             start_perf (bool): If True, begin profiling the node with `perf` as soon as
@@ -82,6 +82,7 @@ class TestNode():
         self.rpc_timeout = timewait
         self.binary = bitcoind
         self.coverage_dir = coverage_dir
+        self.rpc_stats = rpc_stats
         self.cwd = cwd
         self.descriptors = descriptors
         if extra_conf is not None:
@@ -229,6 +230,7 @@ class TestNode():
                     self.index,
                     timeout=self.rpc_timeout // 2,  # Shorter timeout to allow for one retry in case of ETIMEDOUT
                     coveragedir=self.coverage_dir,
+                    rpc_stats=self.rpc_stats,
                 )
                 rpc.getblockcount()
                 # If the call to getblockcount() succeeds then the RPC connection is up
@@ -556,6 +558,33 @@ class TestNode():
 
         return p2p_conn
 
+    def add_p2p_swarm(self, num_peers, p2p_class=P2PInterface, *, wait_for_verack=True, **kwargs):
+        """Add num_peers inbound p2p connections to the node at once.
+
+        All connections are opened concurrently on the network thread and
+        their handshakes complete in parallel, so this is much faster than
+        calling add_p2p_connection() in a loop. Keyword arguments not
+        consumed by peer_connect() are passed to the p2p_class constructor.
+        Note that the node only accepts as many inbound peers as its
+        -maxconnections setting allows.
+
+        The connections are added to the self.p2ps list. Returns a P2PSwarm."""
+        connect_kwargs = {key: kwargs.pop(key) for key in ('dstaddr', 'dstport', 'services', 'send_version') if key in kwargs}
+        connect_kwargs.setdefault('dstport', p2p_port(self.index))
+        connect_kwargs.setdefault('dstaddr', '127.0.0.1')
+
+        swarm = P2PSwarm(p2p_class(**kwargs) for _ in range(num_peers))
+        for p2p_conn in swarm:
+            p2p_conn.peer_connect(**connect_kwargs, net=self.chain, timeout_factor=self.timeout_factor)()
+        self.p2ps.extend(swarm)
+        swarm.wait_until(lambda p: p.is_connected, check_connected=False)
+        if wait_for_verack:
+            # See add_p2p_connection() for why the ping is needed after the verack
+            swarm.wait_for_verack()
+            swarm.sync_with_ping()
+
+        return swarm
+
     def add_outbound_p2p_connection(self, p2p_conn, *, p2p_idx, connection_type="outbound-full-relay", **kwargs):
         """Add an outbound p2p connection from node. Either
         full-relay("outbound-full-relay") or
@@ -6,6 +6,7 @@
 
 from base64 import b64encode
 from binascii import unhexlify
+from collections import Counter
 from decimal import Decimal, ROUND_DOWN
 from subprocess import CalledProcessError
 import hashlib
@@ -14,10 +15,15 @@ import json
 import logging
 import os
 import re
+import shutil
+import sys
+import tempfile
+import threading
 import time
 import unittest
 
 from . import coverage
+from . import rpcstats
 from .authproxy import AuthServiceProxy, JSONRPCException
 from io import BytesIO
 
@@ -234,6 +240,11 @@ def wait_until_helper(predicate, *, attempts=float('inf'), timeout=float('inf'),
     from `BitcoinTestFramework` or `P2PInterface` class ensures the timeout is
     properly scaled. Furthermore, `wait_until()` from `P2PInterface` class in
     `p2p.py` has a preset lock.
+
+    If the lock is a `threading.Condition`, the predicate is re-evaluated as
+    soon as the condition is notified (e.g. `p2p_lock` is notified whenever a
+    P2P message is received), and otherwise at the usual polling interval to
+    pick up state changes that are not notified.
     """
     if attempts == float('inf') and timeout == float('inf'):
         timeout = 60
@@ -242,7 +253,15 @@ def wait_until_helper(predicate, *, attempts=float('inf'), timeout=float('inf'),
     time_end = time.time() + timeout
 
     while attempt < attempts and time.time() < time_end:
-        if lock:
+        if isinstance(lock, threading.Condition):
+            with lock:
+                if predicate():
+                    return
+                # Only count wake-ups due to the polling interval as attempts
+                if not lock.wait(timeout=max(0, min(0.05, time_end - time.time()))):
+                    attempt += 1
+            continue
+        elif lock:
             with lock:
                 if predicate():
                     return
@@ -286,7 +305,7 @@ class PortSeed:
     n = None
 
 
-def get_rpc_proxy(url, node_number, *, timeout=None, coveragedir=None):
+def get_rpc_proxy(url, node_number, *, timeout=None, coveragedir=None, rpc_stats=None):
     """
     Args:
         url (str): URL of the RPC server to call
@@ -295,6 +314,7 @@ def get_rpc_proxy(url, node_number, *, timeout=None, coveragedir=None):
     Kwargs:
         timeout (int): HTTP timeout in seconds
         coveragedir (str): Directory
+        rpc_stats (RPCStats): if specified, record the latency and size of each RPC call
 
     Returns:
         AuthServiceProxy. convenience object for making RPC calls.
@@ -309,7 +329,10 @@ def get_rpc_proxy(url, node_number, *, timeout=None, coveragedir=None):
 
     coverage_logfile = coverage.get_filename(coveragedir, node_number) if coveragedir else None
 
-    return coverage.AuthServiceProxyWrapper(proxy, coverage_logfile)
+    proxy = coverage.AuthServiceProxyWrapper(proxy, coverage_logfile)
+    if rpc_stats is not None:
+        proxy = rpcstats.AuthServiceProxyStatsWrapper(proxy, rpc_stats, node_number)
+    return proxy
 
 
 def p2p_port(n):
@@ -383,6 +406,68 @@ def get_datadir_path(dirname, n):
     return os.path.join(dirname, "node" + str(n))
 
 
+# Linux ioctl to clone a file (reflink) on copy-on-write filesystems such as btrfs and xfs
+FICLONE = 0x40049409
+BLOCK_FILE_RE = re.compile(r'^blk\d{5}\.dat$')
+
+
+def clone_file(src, dst):
+    """Copy src to dst as a copy-on-write clone if the filesystem supports it, otherwise copy it.
+
+    Returns 'cloned' or 'copied'."""
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if cloned:
+            shutil.copystat(src, dst)
+            return 'cloned'
+    shutil.copy2(src, dst)
+    return 'copied'
+
+
+def copy_datadir(from_dir, to_dir):
+    """Copy the node datadir from_dir to to_dir, sharing storage where that is safe.
+
+    Files that a node never modifies are hardlinked: LevelDB table files
+    (*.ldb) and the block files (blk?????.dat) except the last one of a
+    directory, which is still appended to. All other files are cloned, or
+    copied if the filesystem does not support clones (see clone_file()).
+
+    Returns a Counter of the number of files 'linked', 'cloned' and 'copied'."""
+    counts = Counter()
+    last_block_files = {}
+
+    def is_immutable(path):
+        dirname, name = os.path.split(path)
+        if name.endswith('.ldb'):
+            return True
+        if not BLOCK_FILE_RE.match(name):
+            return False
+        if dirname not in last_block_files:
+            last_block_files[dirname] = max(f for f in os.listdir(dirname) if BLOCK_FILE_RE.match(f))
+        return name != last_block_files[dirname]
+
+    def copy_function(src, dst):
+        if is_immutable(src):
+            try:
+                os.link(src, dst)
+                counts['linked'] += 1
+                return dst
+            except OSError:
+                # e.g. different filesystems
+                pass
+        counts[clone_file(src, dst)] += 1
+        return dst
+
+    shutil.copytree(from_dir, to_dir, copy_function=copy_function)
+    return counts
+
+
 def append_config(datadir, options):
     with open(os.path.join(datadir, "bitcoin.conf"), 'a', encoding='utf8') as f:
         for option in options:
@@ -578,3 +663,38 @@ class TestFrameworkUtil(unittest.TestCase):
 
         for a, n in test_vectors:
             self.assertEqual(modinv(a, n), pow(a, n-2, n))
+
+    def test_wait_until_helper_condition(self):
+        cond = threading.Condition()
+        state = []
+
+        def set_state():
+            with cond:
+                state.append(True)
+                cond.notify_all()
+
+        # The predicate is re-evaluated on notify, long before the first polling attempt would time out
+        timer = threading.Timer(0.01, set_state)
+        timer.start()
+        wait_until_helper(lambda: state, attempts=1, lock=cond)
+        timer.join()
+
+    def test_copy_datadir(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            from_dir = os.path.join(tmpdir, 'from')
+            files = ['blocks/blk00000.dat', 'blocks/blk00001.dat', 'blocks/rev00000.dat', 'blocks/index/000003.ldb', 'blocks/index/CURRENT', 'chainstate/000005.ldb', 'chainstate/000006.log']
+            for f in files:
+                os.makedirs(os.path.dirname(os.path.join(from_dir, f)), exist_ok=True)
+                with open(os.path.join(from_dir, f), 'w', encoding='utf8') as fh:
+                    fh.write(f)
+            to_dir = os.path.join(tmpdir, 'to')
+            counts = copy_datadir(from_dir, to_dir)
+            self.assertEqual(counts['linked'], 3)
+            self.assertEqual(sum(counts.values()), len(files))
+            for f in files:
+                with open(os.path.join(to_dir, f), 'r', encoding='utf8') as fh:
+                    self.assertEqual(fh.read(), f)
+                linked = os.path.samefile(os.path.join(from_dir, f), os.path.join(to_dir, f))
+                # Only the immutable files may share storage with the source
+                if linked:
+                    self.assertIn(f, ['blocks/blk00000.dat', 'blocks/index/000003.ldb', 'chainstate/000005.ldb'])
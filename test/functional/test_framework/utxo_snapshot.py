@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Copyright (c) 2021 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""Streaming reader for UTXO snapshot files written by the dumptxoutset RPC.
+
+A snapshot file is the serialized SnapshotMetadata (base block hash and
+coin count), followed by coins_count pairs of a COutPoint and a Coin in
+the compressed database format (see src/compressor.h and src/coins.h).
+
+The file is read in chunks of a fixed size through a memoryview cursor, and
+the coins are decoded directly into the serialization that the UTXO set
+hash commits to (TxOutSer in src/node/coinstats.cpp), without building
+CTxOut objects. snapshot_stats() uses this to recompute the statistics of
+gettxoutsetinfo, including the muhash, with bounded memory.
+"""
+
+from decimal import Decimal
+import io
+import struct
+import unittest
+
+from .key import ECPubKey
+from .messages import ser_compact_size
+from .muhash import MuHash3072
+
+SNAPSHOT_CHUNK_SIZE = 1 << 20
+# Number of coins passed to MuHash3072.insert_many at once
+MUHASH_BATCH_SIZE = 10000
+# Number of special script types in the script compression (see src/compressor.h)
+NUM_SPECIAL_SCRIPTS = 6
+MAX_SCRIPT_SIZE = 10000
+OP_RETURN_SCRIPT = b'\x6a'
+
+
+def compress_amount(n):
+    """Compress an amount in satoshis (see CompressAmount in src/compressor.cpp)."""
+    if n == 0:
+        return 0
+    e = 0
+    while n % 10 == 0 and e < 9:
+        n //= 10
+        e += 1
+    if e < 9:
+        d = n % 10
+        n //= 10
+        return 1 + (n * 9 + d - 1) * 10 + e
+    return 1 + (n - 1) * 10 + 9
+
+
+def decompress_amount(x):
+    """Decompress an amount in satoshis (see DecompressAmount in src/compressor.cpp)."""
+    if x == 0:
+        return 0
+    x -= 1
+    e = x % 10
+    x //= 10
+    if e < 9:
+        d = x % 9 + 1
+        x //= 9
+        n = x * 10 + d
+    else:
+        n = x + 1
+    return n * 10 ** e
+
+
+def ser_varint(n):
+    """Serialize a non-negative integer in the VARINT format (see src/serialize.h)."""
+    out = bytearray([n & 0x7f])
+    while n > 0x7f:
+        n = (n >> 7) - 1
+        out.append((n & 0x7f) | 0x80)
+    return bytes(reversed(out))
+
+
+def decompress_script(script_type, data):
+    """Return the scriptPubKey of a special script type (see DecompressScript in src/compressor.cpp)."""
+    if script_type == 0:
+        return b'\x76\xa9\x14' + data + b'\x88\xac'
+    if script_type == 1:
+        return b'\xa9\x14' + data + b'\x87'
+    if script_type in (2, 3):
+        return bytes([33, script_type]) + data + b'\xac'
+    # Uncompressed public key, stored as its x coordinate and the parity of y
+    pubkey = ECPubKey()
+    pubkey.set(bytes([script_type - 2]) + data)
+    if not pubkey.is_valid:
+        # Coin::Unserialize leaves the script empty
+        return b''
+    pubkey.compressed = False
+    return bytes([65]) + pubkey.get_bytes() + b'\xac'
+
+
+class UTXOSnapshotReader():
+    """Read the metadata and coins of a UTXO snapshot from a binary file object f.
+
+    Only chunk_size bytes of the file (plus at most one coin) are in memory
+    at any time."""
+    def __init__(self, f, chunk_size=SNAPSHOT_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = memoryview(b'')
+        self.pos = 0
+        self.base_hash = bytes(self._read(32))[::-1].hex()
+        self.coins_count = struct.unpack('<Q', self._read(8))[0]
+
+    def _ensure(self, n):
+        """Make sure that the next n bytes of the file are in the buffer."""
+        if self.pos + n <= len(self.buf):
+            return
+        data = bytes(self.buf[self.pos:]) + self.f.read(max(self.chunk_size, n))
+        if len(data) < n:
+            raise EOFError("Unexpected end of UTXO snapshot file")
+        self.buf = memoryview(data)
+        self.pos = 0
+
+    def _read(self, n):
+        self._ensure(n)
+        self.pos += n
+        return self.buf[self.pos - n:self.pos]
+
+    def _read_varint(self):
+        n = 0
+        while True:
+            self._ensure(1)
+            ch = self.buf[self.pos]
+            self.pos += 1
+            n = (n << 7) | (ch & 0x7f)
+            if not ch & 0x80:
+                return n
+            n += 1
+
+    def coins(self):
+        """Yield (txout_ser, amount, script) for each coin of the snapshot.
+
+        txout_ser is the serialized outpoint, height and coinbase flag, and
+        output, as committed to by the UTXO set hash. amount is in satoshis
+        and script is the scriptPubKey."""
+        for _ in range(self.coins_count):
+            outpoint = bytes(self._read(36))
+            code = self._read_varint()
+            amount = decompress_amount(self._read_varint())
+            script_size = self._read_varint()
+            if script_size < NUM_SPECIAL_SCRIPTS:
+                script = decompress_script(script_size, bytes(self._read(20 if script_size < 2 else 32)))
+            elif script_size - NUM_SPECIAL_SCRIPTS > MAX_SCRIPT_SIZE:
+                # Overly long script, replaced with a short invalid one when loaded
+                self._read(script_size - NUM_SPECIAL_SCRIPTS)
+                script = OP_RETURN_SCRIPT
+            else:
+                script = bytes(self._read(script_size - NUM_SPECIAL_SCRIPTS))
+            txout_ser = outpoint + struct.pack('<Iq', code, amount) + ser_compact_size(len(script)) + script
+            yield txout_ser, amount, script
+        if self.pos < len(self.buf) or self.f.read(1):
+            raise ValueError("Unexpected data after the coins of the UTXO snapshot file")
+
+
+def snapshot_stats(filename, *, chunk_size=SNAPSHOT_CHUNK_SIZE, batch_size=MUHASH_BATCH_SIZE, processes=1):
+    """Compute the statistics of gettxoutsetinfo("muhash") for a UTXO snapshot file.
+
+    Returns a dict with the fields base_hash, txouts, transactions, bogosize,
+    total_amount (in BTC) and muhash. processes is passed to
+    MuHash3072.insert_many."""
+    muhash = MuHash3072()
+    txouts = 0
+    transactions = 0
+    bogosize = 0
+    total_amount = 0
+    last_txid = None
+    batch = []
+    with open(filename, 'rb') as f:
+        reader = UTXOSnapshotReader(f, chunk_size)
+        for txout_ser, amount, script in reader.coins():
+            txouts += 1
+            total_amount += amount
+            # Coins are sorted by outpoint, so the outputs of a transaction are consecutive.
+            if txout_ser[:32] != last_txid:
+                transactions += 1
+                last_txid = txout_ser[:32]
+            # See GetBogoSize in src/node/coinstats.cpp
+            bogosize += 32 + 4 + 4 + 8 + 2 + len(script)
+            batch.append(txout_ser)
+            if len(batch) >= batch_size:
+                muhash.insert_many(batch, processes=processes)
+                batch = []
+        muhash.insert_many(batch, processes=processes)
+    return {
+        'base_hash': reader.base_hash,
+        'txouts': txouts,
+        'transactions': transactions,
+        'bogosize': bogosize,
+        'total_amount': Decimal(total_amount) / 100000000,
+        'muhash': muhash.digest()[::-1].hex(),
+    }
+
+
+class TestFrameworkUTXOSnapshot(unittest.TestCase):
+    def test_amount_compression(self):
+        for n in [0, 1, 9, 10, 50, 1000, 123456789, 50 * 100000000, 21000000 * 100000000]:
+            self.assertEqual(decompress_amount(compress_amount(n)), n)
+        self.assertEqual(compress_amount(50 * 100000000), 0x32)
+
+    def test_reader(self):
+        # One P2PKH coin (compressed script), and one coin with a raw script
+        # that is read across a chunk boundary.
+        snapshot = bytes(range(32)) + struct.pack('<Q', 2)
+        snapshot += b'\x11' * 32 + struct.pack('<I', 0) + ser_varint(201) + ser_varint(compress_amount(5000)) + ser_varint(0) + b'\x22' * 20
+        snapshot += b'\x11' * 32 + struct.pack('<I', 1) + ser_varint(200) + ser_varint(compress_amount(0)) + ser_varint(NUM_SPECIAL_SCRIPTS + 3) + b'\x51\x52\x53'
+        reader = UTXOSnapshotReader(io.BytesIO(snapshot), chunk_size=7)
+        self.assertEqual(reader.base_hash, bytes(range(32))[::-1].hex())
+        coins = list(reader.coins())
+        self.assertEqual(coins, [
+            (b'\x11' * 32 + struct.pack('<IIq', 0, 201, 5000) + b'\x19\x76\xa9\x14' + b'\x22' * 20 + b'\x88\xac', 5000, b'\x76\xa9\x14' + b'\x22' * 20 + b'\x88\xac'),
+            (b'\x11' * 32 + struct.pack('<IIq', 1, 200, 0) + b'\x03\x51\x52\x53', 0, b'\x51\x52\x53'),
+        ])
+        with self.assertRaises(EOFError):
+            list(UTXOSnapshotReader(io.BytesIO(snapshot[:-1])).coins())
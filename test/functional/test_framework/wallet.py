@@ -4,7 +4,11 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 """A limited-functionality wallet, which may replace a real wallet in tests"""
 
+import collections
 from decimal import Decimal
+import math
+import unittest
+
 from test_framework.address import ADDRESS_BCRT1_P2WSH_OP_TRUE
 from test_framework.messages import (
     COIN,
@@ -13,6 +17,8 @@ from test_framework.messages import (
     CTxIn,
     CTxInWitness,
     CTxOut,
+    hash256,
+    uint256_from_str,
 )
 from test_framework.script import (
     CScript,
@@ -30,6 +36,9 @@ class MiniWallet:
     def __init__(self, test_node, *, raw_script=False):
         self._test_node = test_node
         self._utxos = []
+        # UTXOs for the bulk transaction methods (create_fan_out(), create_bulk_transactions()),
+        # as a FIFO of (value in satoshis, txid, vout). Each one is spent by a single chain.
+        self._bulk_utxos = collections.deque()
         if raw_script:
             self._address = None
             self._scriptPubKey = bytes(CScript([OP_TRUE]))
@@ -94,15 +103,7 @@ class MiniWallet:
         fee = utxo_to_spend['value'] - send_value
         assert send_value > 0
 
-        tx = CTransaction()
-        tx.vin = [CTxIn(COutPoint(int(utxo_to_spend['txid'], 16), utxo_to_spend['vout']))]
-        tx.vout = [CTxOut(int(send_value * COIN), self._scriptPubKey)]
-        if not self._address:
-            # raw script
-            tx.vin[0].scriptSig = CScript([OP_NOP] * 35)  # pad to identical size
-        else:
-            tx.wit.vtxinwit = [CTxInWitness()]
-            tx.wit.vtxinwit[0].scriptWitness.stack = [CScript([OP_TRUE])]
+        tx = self._create_tx([COutPoint(int(utxo_to_spend['txid'], 16), utxo_to_spend['vout'])], [int(send_value * COIN)])
         tx_hex = tx.serialize().hex()
 
         tx_info = from_node.testmempoolaccept([tx_hex])[0]
@@ -115,3 +116,118 @@ class MiniWallet:
     def sendrawtransaction(self, *, from_node, tx_hex):
         from_node.sendrawtransaction(tx_hex)
         self.scan_tx(from_node.decoderawtransaction(tx_hex))
+
+    def _create_tx(self, outpoints, values):
+        """Return a tx spending outpoints of this wallet to outputs of the given values (in satoshis) to this wallet"""
+        tx = CTransaction()
+        tx.vin = [CTxIn(outpoint) for outpoint in outpoints]
+        tx.vout = [CTxOut(value, self._scriptPubKey) for value in values]
+        if not self._address:
+            # raw script
+            for txin in tx.vin:
+                txin.scriptSig = CScript([OP_NOP] * 35)  # pad to identical size
+        else:
+            tx.wit.vtxinwit = [CTxInWitness() for _ in tx.vin]
+            for txinwit in tx.wit.vtxinwit:
+                txinwit.scriptWitness.stack = [CScript([OP_TRUE])]
+        return tx
+
+    @staticmethod
+    def _bulk_tx_info(tx):
+        """Compute the txid locally and return the tx in the format of create_self_transfer()"""
+        # Serialize only once with and without witness (tx.rehash() and tx.getwtxid() serialize again)
+        tx_bytes = tx.serialize_with_witness()
+        txid = hash256(tx.serialize_without_witness())
+        tx.sha256 = uint256_from_str(txid)
+        tx.hash = txid[::-1].hex()
+        return {'txid': tx.hash, 'wtxid': hash256(tx_bytes)[::-1].hex(), 'hex': tx_bytes.hex(), 'tx': tx}
+
+    def get_bulk_utxo_count(self):
+        return len(self._bulk_utxos)
+
+    def create_fan_out(self, *, num_outputs, utxo_to_spend=None, fee_rate=Decimal("0.00001")):
+        """Create a tx that splits one utxo into num_outputs equal outputs, and add them to the bulk utxos.
+
+        utxo_to_spend defaults to a utxo of get_utxo(). The tx is not sent
+        (see send_bulk()). fee_rate is in BTC/kvB. The outputs are spendable
+        by create_bulk_transactions() immediately."""
+        utxo_to_spend = utxo_to_spend or self.get_utxo()
+        value = int(utxo_to_spend['value'] * COIN)
+        tx = self._create_tx([COutPoint(int(utxo_to_spend['txid'], 16), utxo_to_spend['vout'])], [0] * num_outputs)
+        fee = math.ceil(tx.get_vsize() * fee_rate * COIN / 1000)
+        output_value = (value - fee) // num_outputs
+        assert output_value > 0
+        for txout in tx.vout:
+            txout.nValue = output_value
+        tx_info = self._bulk_tx_info(tx)
+        self._bulk_utxos.extend((output_value, tx_info['txid'], n) for n in range(num_outputs))
+        return tx_info
+
+    def create_bulk_transactions(self, num_txs, *, chain_length=1, fee_rate=Decimal("0.00001")):
+        """Create num_txs one-input, one-output txs spending the bulk utxos, without any RPC.
+
+        The txs form chains of chain_length txs, each spending the output of
+        the previous one (chain_length=1 creates independent txs). Each chain
+        spends the oldest unspent bulk utxo, and the outputs of the txs are
+        not added to the bulk utxos, so that no chain depends on another one:
+        once the fan-out txs are confirmed, the first tx of each chain spends
+        a confirmed output. Amounts are handled in integer satoshis and
+        fee_rate is in BTC/kvB. Returns the txs in the format of
+        create_self_transfer(), in an order that can be sent with
+        send_bulk()."""
+        # All txs have the same size, as the outpoints and amounts have a fixed size
+        fee = math.ceil(self._create_tx([COutPoint()], [0]).get_vsize() * fee_rate * COIN / 1000)
+        txs = []
+        while len(txs) < num_txs:
+            assert self._bulk_utxos, "No bulk utxos left, call create_fan_out() first"
+            value, txid, vout = self._bulk_utxos.popleft()
+            for _ in range(min(chain_length, num_txs - len(txs))):
+                value -= fee
+                assert value > 0
+                tx_info = self._bulk_tx_info(self._create_tx([COutPoint(int(txid, 16), vout)], [value]))
+                txs.append(tx_info)
+                txid, vout = tx_info['txid'], 0
+        return txs
+
+    def send_bulk(self, *, from_node, txs, chunk_size=1000):
+        """Send txs (as returned by create_fan_out() and create_bulk_transactions()) in JSON-RPC batches, in order.
+
+        Returns the txids, and asserts that they match the locally computed ones."""
+        requests = (from_node.sendrawtransaction.get_request(tx['hex']) for tx in txs)
+        # One batch at a time, as a tx may spend an output of a tx in the previous batch
+        txids = list(from_node.batch_execute(requests, chunk_size=chunk_size, max_in_flight=1))
+        assert_equal(txids, [tx['txid'] for tx in txs])
+        return txids
+
+
+class TestFrameworkMiniWallet(unittest.TestCase):
+    def fund(self, wallet, num_outputs, n):
+        """Add num_outputs bulk utxos from a fan-out of a made up 50 BTC utxo, and return the fan-out tx."""
+        return wallet.create_fan_out(num_outputs=num_outputs, utxo_to_spend={'txid': '%064x' % n, 'vout': 0, 'value': Decimal(50)})
+
+    def test_bulk_transactions_spend_fan_out_outputs(self):
+        wallet = MiniWallet(None, raw_script=True)
+        fan_outs = [self.fund(wallet, 1000, 1), self.fund(wallet, 100, 2)]
+        fan_out_outputs = [(int(tx['txid'], 16), n) for tx in fan_outs for n in range(len(tx['tx'].vout))]
+        txs = wallet.create_bulk_transactions(1100)
+        # Each tx spends its own fan-out output, so that none has an unconfirmed parent
+        assert_equal([(tx['tx'].vin[0].prevout.hash, tx['tx'].vin[0].prevout.n) for tx in txs], fan_out_outputs)
+        assert_equal(wallet.get_bulk_utxo_count(), 0)
+        with self.assertRaises(AssertionError):
+            wallet.create_bulk_transactions(1)
+
+    def test_bulk_transaction_chains(self):
+        wallet = MiniWallet(None, raw_script=True)
+        fan_out = self.fund(wallet, 5, 1)
+        txs = wallet.create_bulk_transactions(12, chain_length=5)
+        # Chains of 5, 5 and 2 txs, each starting at its own fan-out output
+        for i, tx in enumerate(txs):
+            prevout = tx['tx'].vin[0].prevout
+            if i in [0, 5, 10]:
+                assert_equal((prevout.hash, prevout.n), (int(fan_out['txid'], 16), [0, 5, 10].index(i)))
+            else:
+                assert_equal((prevout.hash, prevout.n), (int(txs[i - 1]['txid'], 16), 0))
+        # The outputs of the chains are not spent again
+        assert_equal(wallet.get_bulk_utxo_count(), 2)
+        txs = wallet.create_bulk_transactions(2)
+        assert_equal([tx['tx'].vin[0].prevout.n for tx in txs], [3, 4])
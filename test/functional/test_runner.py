@@ -15,7 +15,11 @@ For a description of arguments recognized by test scripts, see
 import argparse
 from collections import deque
 import configparser
+import contextlib
 import datetime
+import heapq
+import io
+import json
 import os
 import time
 import shutil
@@ -24,6 +28,7 @@ import sys
 import tempfile
 import re
 import logging
+import selectors
 import unittest
 
 # Formatting. Default colors to empty strings.
@@ -68,12 +73,19 @@ TEST_EXIT_SKIPPED = 77
 
 TEST_FRAMEWORK_MODULES = [
     "address",
+    "authproxy",
     "blocktools",
+    "fixtures",
     "muhash",
     "key",
+    "messages",
     "script",
+    "rpcstats",
     "segwit_addr",
+    "siphash",
     "util",
+    "utxo_snapshot",
+    "wallet",
 ]
 
 EXTENDED_SCRIPTS = [
@@ -81,11 +93,13 @@ EXTENDED_SCRIPTS = [
     # Longest test should go first, to favor running tests in parallel
     'feature_pruning.py',
     'feature_dbcrash.py',
+    'p2p_message_rate.py',
 ]
 
 BASE_SCRIPTS = [
     # Scripts that are run by default.
     # Longest test should go first, to favor running tests in parallel
+    # (only used for tests without measured durations, see TestTimings)
     'wallet_hd.py --legacy-wallet',
     'wallet_hd.py --descriptors',
     'wallet_backup.py --legacy-wallet',
@@ -139,6 +153,8 @@ BASE_SCRIPTS = [
     'rpc_invalid_address_message.py',
     'interface_bitcoin_cli.py',
     'mempool_resurrect.py',
+    'feature_chain_fixture.py',
+    'mempool_bulk.py',
     'wallet_txn_doublespend.py --mineblock',
     'tool_wallet.py --legacy-wallet',
     'tool_wallet.py --descriptors',
@@ -326,6 +342,7 @@ def main():
     parser.add_argument('--help', '-h', '-?', action='store_true', help='print help text and exit')
     parser.add_argument('--jobs', '-j', type=int, default=4, help='how many test scripts to run in parallel. Default=4.')
     parser.add_argument('--keepcache', '-k', action='store_true', help='the default behavior is to flush the cache directory on startup. --keepcache retains the cache from the previous testrun.')
+    parser.add_argument('--rpcstats', nargs='?', const='', metavar='FILE', help='collect per-RPC-method latency and size statistics, print a summary and, if FILE is given, write the aggregated statistics to FILE as JSON')
     parser.add_argument('--quiet', '-q', action='store_true', help='only print dots, results summary and failure logs')
     parser.add_argument('--tmpdirprefix', '-t', default=tempfile.gettempdir(), help="Root directory for datadirs")
     parser.add_argument('--failfast', action='store_true', help='stop execution after the first test failure')
@@ -435,13 +452,14 @@ def main():
         tmpdir=tmpdir,
         jobs=args.jobs,
         enable_coverage=args.coverage,
+        rpcstats_file=args.rpcstats,
         args=passon_args,
         combined_logs_len=args.combinedlogslen,
         failfast=args.failfast,
         use_term_control=args.ansi,
     )
 
-def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, args=None, combined_logs_len=0, failfast=False, use_term_control):
+def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=False, rpcstats_file=None, args=None, combined_logs_len=0, failfast=False, use_term_control):
     args = args or []
 
     # Warn if bitcoind is already running
@@ -463,6 +481,7 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
     test_framework_tests = unittest.TestSuite()
     for module in TEST_FRAMEWORK_MODULES:
         test_framework_tests.addTest(unittest.TestLoader().loadTestsFromName("test_framework.{}".format(module)))
+    test_framework_tests.addTest(unittest.TestLoader().loadTestsFromTestCase(TestTestHandler))
     result = unittest.TextTestRunner(verbosity=1, failfast=True).run(test_framework_tests)
     if not result.wasSuccessful():
         logging.debug("Early exiting after failure in TestFramework unit tests")
@@ -470,6 +489,11 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
 
     tests_dir = src_dir + '/test/functional/'
 
+    # Schedule the tests longest first, using the durations measured in previous runs
+    timings = TestTimings("%s/test/test_timings.json" % build_dir)
+    test_list = timings.sort(test_list)
+    logging.debug("Estimated runtime with %d jobs: %d s" % (jobs, timings.estimate_runtime(test_list, jobs)))
+
     flags = ['--cachedir={}'.format(cache_dir)] + args
 
     if enable_coverage:
@@ -479,6 +503,13 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
     else:
         coverage = None
 
+    if rpcstats_file is not None:
+        rpc_stats = RPCStatsReport()
+        flags.append(rpc_stats.flag)
+        logging.debug("Initializing RPC statistics directory at %s" % rpc_stats.dir)
+    else:
+        rpc_stats = None
+
     if len(test_list) > 1 and jobs > 1:
         # Populate cache
         try:
@@ -530,6 +561,10 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
                 break
 
     print_results(test_results, max_len_name, (int(time.time() - start_time)))
+    job_queue.print_utilization()
+
+    timings.update(test_results)
+    timings.write()
 
     if coverage:
         coverage_passed = coverage.report_rpc_coverage()
@@ -539,6 +574,11 @@ def run_tests(*, test_list, src_dir, build_dir, tmpdir, jobs=1, enable_coverage=
     else:
         coverage_passed = True
 
+    if rpc_stats:
+        rpc_stats.report(rpcstats_file)
+        logging.debug("Cleaning up RPC statistics data")
+        rpc_stats.cleanup()
+
     # Clear up the temp directory if all subdirectories are gone
     if not os.listdir(tmpdir):
         os.rmdir(tmpdir)
@@ -588,6 +628,15 @@ class TestHandler:
         self.num_running = 0
         self.jobs = []
         self.use_term_control = use_term_control
+        # Each job gets the write end of a pipe, so that the read end becomes
+        # readable (EOF) as soon as the job exits. Not supported on Windows,
+        # which falls back to polling.
+        self.selector = selectors.DefaultSelector() if os.name == 'posix' else None
+        # Read end of the pipe of each running job, until it is closed
+        self.sentinels = {}
+        self.start_time = time.time()
+        self.queue_waits = []
+        self.busy_time = 0
 
     def get_next(self):
         while self.num_running < self.num_jobs and self.test_list:
@@ -601,12 +650,24 @@ class TestHandler:
             test_argv = test.split()
             testdir = "{}/{}_{}".format(self.tmpdir, re.sub(".py$", "", test_argv[0]), portseed)
             tmpdir_arg = ["--tmpdir={}".format(testdir)]
+            popen_kwargs = {}
+            if self.selector:
+                sentinel_r, sentinel_w = os.pipe()
+                popen_kwargs['pass_fds'] = (sentinel_w,)
+            start_time = time.time()
+            self.queue_waits.append(start_time - self.start_time)
+            proc = subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
+                                    universal_newlines=True,
+                                    stdout=log_stdout,
+                                    stderr=log_stderr,
+                                    **popen_kwargs)
+            if self.selector:
+                os.close(sentinel_w)
+                self.selector.register(sentinel_r, selectors.EVENT_READ, proc)
+                self.sentinels[proc] = sentinel_r
             self.jobs.append((test,
-                              time.time(),
-                              subprocess.Popen([sys.executable, self.tests_dir + test_argv[0]] + test_argv[1:] + self.flags + portseed_arg + tmpdir_arg,
-                                               universal_newlines=True,
-                                               stdout=log_stdout,
-                                               stderr=log_stderr),
+                              start_time,
+                              proc,
                               testdir,
                               log_stdout,
                               log_stderr))
@@ -619,11 +680,12 @@ class TestHandler:
 
         dot_count = 0
         while True:
-            # Return first proc that finishes
-            time.sleep(.5)
+            # Return first proc that finishes. Jobs that finished in an
+            # earlier select are found here, without waiting for another one.
             for job in self.jobs:
                 (name, start_time, proc, testdir, log_out, log_err) = job
                 if proc.poll() is not None:
+                    self._close_sentinel(proc)
                     log_out.seek(0), log_err.seek(0)
                     [stdout, stderr] = [log_file.read().decode('utf-8') for log_file in (log_out, log_err)]
                     log_out.close(), log_err.close()
@@ -635,15 +697,46 @@ class TestHandler:
                         status = "Failed"
                     self.num_running -= 1
                     self.jobs.remove(job)
+                    self.busy_time += time.time() - start_time
                     if self.use_term_control:
                         clearline = '\r' + (' ' * dot_count) + '\r'
                         print(clearline, end='', flush=True)
                     dot_count = 0
                     return TestResult(name, status, int(time.time() - start_time)), testdir, stdout, stderr
-            if self.use_term_control:
+            if self.selector:
+                ready = self.selector.select(timeout=.5)
+                for key, _ in ready:
+                    self._close_sentinel(key.data)
+                    try:
+                        # The pipe is closed just before the process can be reaped
+                        key.data.wait(timeout=1)
+                    except subprocess.TimeoutExpired:
+                        pass
+            else:
+                ready = []
+                time.sleep(.05)
+            if ready:
+                continue
+            if self.use_term_control and (self.selector or dot_count % 10 == 0):
                 print('.', end='', flush=True)
             dot_count += 1
 
+    def _close_sentinel(self, proc):
+        """Stop waiting for the pipe of a job (if still open)."""
+        sentinel = self.sentinels.pop(proc, None)
+        if sentinel is not None:
+            self.selector.unregister(sentinel)
+            os.close(sentinel)
+
+    def print_utilization(self):
+        """Print how long the jobs waited in the queue and how busy the job slots were."""
+        wall_time = time.time() - self.start_time
+        if not self.queue_waits or not wall_time:
+            return
+        print("Queue wait: %.1f s average, %.1f s max" % (sum(self.queue_waits) / len(self.queue_waits), max(self.queue_waits)))
+        print("Slot utilization: %.1f%% (%d s busy of %d slot-seconds)" % (
+            100 * self.busy_time / (self.num_jobs * wall_time), self.busy_time, self.num_jobs * wall_time))
+
     def kill_and_join(self):
         """Send SIGKILL to all jobs and block until all have ended."""
         procs = [i[2] for i in self.jobs]
@@ -654,6 +747,39 @@ class TestHandler:
         for proc in procs:
             proc.wait()
 
+        if self.selector:
+            for key in list(self.selector.get_map().values()):
+                os.close(key.fileobj)
+            self.selector.close()
+
+
+class TestTestHandler(unittest.TestCase):
+    @unittest.skipUnless(os.name == 'posix', "job pipes are only used on POSIX")
+    def test_jobs_finishing_together(self):
+        """Jobs that finish in the same select are all returned without waiting for the select timeout."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "sleep.py"), 'w', encoding='utf8') as f:
+                f.write("import time\ntime.sleep(0.3)\n")
+            handler = TestHandler(num_tests_parallel=2, tests_dir=tmpdir + '/', tmpdir=tmpdir,
+                                  test_list=["sleep.py", "sleep.py"], flags=[], use_term_control=False)
+            select = handler.selector.select
+
+            def delayed_select(timeout=None):
+                # Let both jobs finish before the first select
+                handler.selector.select = select
+                time.sleep(0.5)
+                return select(timeout)
+            handler.selector.select = delayed_select
+            with contextlib.redirect_stdout(io.StringIO()):
+                first = handler.get_next()[0]
+                start = time.time()
+                second = handler.get_next()[0]
+            self.assertLess(time.time() - start, 0.25)
+            self.assertEqual((first.status, second.status), ("Passed", "Passed"))
+            self.assertEqual(handler.sentinels, {})
+            self.assertEqual(len(handler.selector.get_map()), 0)
+            handler.kill_and_join()
+
 
 class TestResult():
     def __init__(self, name, status, time):
@@ -715,6 +841,62 @@ def check_script_list(*, src_dir, fail_on_warn):
             sys.exit(1)
 
 
+class TestTimings():
+    """
+    Database of test durations measured in previous runs, used to schedule
+    the tests longest processing time first.
+
+    The database is a JSON file mapping each test (with its arguments) to an
+    exponential moving average of the durations of its passed runs. It is kept
+    next to the cache directory, so that it survives the cache being flushed.
+
+    """
+    # Weight of the latest measurement in the moving average
+    ALPHA = 0.5
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'r', encoding='utf8') as f:
+                self.durations = json.load(f)
+        except (OSError, ValueError):
+            self.durations = {}
+
+    def sort(self, test_list):
+        """
+        Return test_list sorted by decreasing estimated duration. Tests
+        without measurements go first, in their original order.
+
+        """
+        return sorted(test_list, key=lambda test: -self.durations.get(test, float('inf')))
+
+    def estimate_runtime(self, test_list, jobs):
+        """Estimate the wall time of running test_list in order on `jobs` parallel slots (unknown tests count as 0 s)."""
+        slots = [0] * max(1, jobs)
+        for test in test_list:
+            heapq.heapreplace(slots, slots[0] + self.durations.get(test, 0))
+        return max(slots)
+
+    def update(self, test_results):
+        for test_result in test_results:
+            if test_result.status != "Passed":
+                continue
+            previous = self.durations.get(test_result.name)
+            if previous is None:
+                self.durations[test_result.name] = test_result.time
+            else:
+                self.durations[test_result.name] = round(self.ALPHA * test_result.time + (1 - self.ALPHA) * previous, 1)
+
+    def write(self):
+        tmp_filename = self.filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w', encoding='utf8') as f:
+                json.dump(self.durations, f, indent=1, sort_keys=True)
+            os.replace(tmp_filename, self.filename)
+        except OSError as e:
+            logging.debug("Could not write test timings to %s: %s" % (self.filename, e))
+
+
 class RPCCoverage():
     """
     Coverage reporting utilities for test_runner.
@@ -786,5 +968,44 @@ class RPCCoverage():
         return all_cmds - covered_cmds
 
 
+class RPCStatsReport():
+    """
+    RPC latency and size statistics for test_runner.
+
+    Each test script subprocess writes a summary of the RPC calls it made, per
+    node and method, into a particular directory. After all tests complete,
+    the summaries are aggregated per method and printed, slowest total time first.
+
+    See also: test/functional/test_framework/rpcstats.py
+
+    """
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="rpcstats")
+        self.flag = '--rpcstatsdir=%s' % self.dir
+
+    def report(self, filename):
+        """
+        Print out the aggregated statistics, and write them to filename as JSON if it is given.
+
+        """
+        from test_framework.rpcstats import read_summaries
+        methods = read_summaries(self.dir)
+        print("RPC statistics:")
+        print("{:<32} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9} {:>9} {:>12} {:>12}".format(
+            "method", "calls", "errors", "total s", "p50 ms", "p90 ms", "p99 ms", "max ms", "req bytes", "resp bytes"))
+        for method, stats in sorted(methods.items(), key=lambda item: item[1].total_latency, reverse=True):
+            print("{:<32} {:>8} {:>7} {:>10.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>12} {:>12}".format(
+                method, stats.count, stats.errors, stats.total_latency,
+                stats.percentile(50) * 1000, stats.percentile(90) * 1000, stats.percentile(99) * 1000, stats.max_latency * 1000,
+                stats.request_bytes, stats.response_bytes))
+        if filename:
+            with open(filename, 'w', encoding='utf8') as f:
+                json.dump({method: stats.to_dict() for method, stats in methods.items()}, f, indent=1, sort_keys=True)
+            print("Wrote RPC statistics to %s" % filename)
+
+    def cleanup(self):
+        return shutil.rmtree(self.dir)
+
+
 if __name__ == '__main__':
     main()